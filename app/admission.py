@@ -0,0 +1,169 @@
+# app/admission.py
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-endpoint concurrency limits (requests doing embedding / DB work at once)
+DEFAULT_LIMITS = {
+    "register": int(os.getenv("REGISTER_MAX_CONCURRENCY", "2")),
+    "register_bulk": int(os.getenv("REGISTER_BULK_MAX_CONCURRENCY", "1")),
+    "decrypt": int(os.getenv("DECRYPT_MAX_CONCURRENCY", "4")),
+    # Embedding-in endpoints skip the image pipeline, so they can run wider
+    "identify": int(os.getenv("IDENTIFY_MAX_CONCURRENCY", "8")),
+    "verify": int(os.getenv("VERIFY_MAX_CONCURRENCY", "8")),
+}
+# Requests allowed to wait for a slot, per endpoint; beyond this we shed load
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Longest a request waits in the queue when the client sent no deadline
+ADMISSION_DEFAULT_TIMEOUT = float(os.getenv("ADMISSION_DEFAULT_TIMEOUT_MS", "5000")) / 1000.0
+
+TIMEOUT_HEADER = "x-request-timeout-ms"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int):
+        super().__init__(f"{endpoint} is saturated ({reason}), retry after {retry_after}s")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's budget runs out while it is being served."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded ({stage})")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    End-to-end budget of one request, from X-Request-Timeout-Ms.
+    - The admission queue waits at most the remaining budget for a slot
+    - Once admitted, handlers call check() between stages (image loading,
+      embedding, search, DB write), so work the client gave up on stops
+      instead of holding a slot to the end
+    - Without the header there is no deadline: only the queue wait is limited
+      (ADMISSION_DEFAULT_TIMEOUT_MS)
+    """
+
+    def __init__(self, seconds: float | None = None):
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self) -> float | None:
+        """Seconds left, or None without a deadline."""
+        return None if self.expires_at is None else self.expires_at - time.monotonic()
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if the budget ran out before `stage`."""
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(stage)
+
+
+def _budget_from_headers(headers) -> float | None:
+    value = headers.get(TIMEOUT_HEADER)
+    if value is None:
+        return None
+    try:
+        return float(value) / 1000.0
+    except ValueError:
+        return None
+
+
+def timeout_from_headers(headers, default: float = ADMISSION_DEFAULT_TIMEOUT) -> float:
+    """Remaining client budget in seconds from X-Request-Timeout-Ms, else the default."""
+    budget = _budget_from_headers(headers)
+    return default if budget is None else budget
+
+
+def deadline_from_headers(headers) -> Deadline:
+    """The request's Deadline (none if the client sent no X-Request-Timeout-Ms)."""
+    return Deadline(_budget_from_headers(headers))
+
+
+class AdmissionController:
+    """
+    Bounded admission queue for one endpoint.
+    - At most max_concurrency requests run; up to max_queue more wait
+    - A full queue, or a wait that would outlive the client's deadline,
+      is rejected immediately with a Retry-After estimate
+    """
+
+    def __init__(self, endpoint: str, max_concurrency: int, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = {"queue_full": 0, "deadline": 0}
+        self.avg_service_seconds = 0.0  # EWMA of time spent holding a slot
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from queue depth and service time."""
+        backlog = (self.queued + 1) * max(self.avg_service_seconds, 0.05)
+        return max(1, math.ceil(backlog / self.max_concurrency))
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(self.endpoint, reason, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, timeout: float = ADMISSION_DEFAULT_TIMEOUT):
+        if timeout <= 0:
+            self._reject("deadline")
+
+        if self._sem.locked():
+            if self.queued >= self.max_queue:
+                self._reject("queue_full")
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self._reject("deadline")
+            finally:
+                self.queued -= 1
+        else:
+            await self._sem.acquire()
+
+        self.admitted += 1
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.avg_service_seconds = elapsed if self.completed == 0 else 0.8 * self.avg_service_seconds + 0.2 * elapsed
+            self.completed += 1
+            self.in_flight -= 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected": dict(self.rejected),
+            "avg_service_seconds": round(self.avg_service_seconds, 4),
+        }
+
+
+def build_controllers(limits: dict | None = None, max_queue: int = ADMISSION_MAX_QUEUE) -> dict:
+    """One AdmissionController per endpoint name."""
+    limits = {**DEFAULT_LIMITS, **(limits or {})}
+    return {name: AdmissionController(name, limit, max_queue) for name, limit in limits.items()}
@@ -0,0 +1,246 @@
+# app/ann.py
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Written by `python -m app.ann_tune`, read at gallery warm-up
+ANN_CONFIG_PATH = os.getenv("ANN_CONFIG_PATH", "./data/ann_config.json")
+# Rebuild the index once this share of its entries belongs to removed templates
+ANN_REBUILD_STALE = float(os.getenv("ANN_REBUILD_STALE", "0.2"))
+
+INDEX_KINDS = ("exact", "flat", "hnsw", "ivf", "ivfpq")
+SEARCH_PARAMS = ("efSearch", "nprobe")  # changeable without rebuilding the index
+
+
+def build_params(config: dict) -> tuple:
+    """What an index is built from; configs equal here share one index."""
+    params = config.get("params", {})
+    return config["kind"], tuple(sorted((k, v) for k, v in params.items() if k not in SEARCH_PARAMS))
+
+
+def min_train_size(config: dict) -> int:
+    """Templates needed before an index of this kind can be trained (else exact search is used)."""
+    params = config.get("params", {})
+    if config["kind"] == "ivf":
+        return 39 * params["nlist"]
+    if config["kind"] == "ivfpq":
+        return max(39 * params["nlist"], 39 * 2 ** params.get("nbits", 8))
+    return 1
+
+
+def build_index(config: dict, dim: int, unit_vectors: np.ndarray, template_ids: np.ndarray):
+    """A trained faiss inner-product index over unit vectors (so scores are cosines), keyed by template id."""
+    import faiss
+
+    kind, params = config["kind"], config.get("params", {})
+    if kind == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+    elif kind == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, params["M"], faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = params.get("efConstruction", 40)
+        index = faiss.IndexIDMap(base)
+    elif kind in ("ivf", "ivfpq"):
+        quantizer = faiss.IndexFlatIP(dim)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"], faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["m"], params.get("nbits", 8),
+                                     faiss.METRIC_INNER_PRODUCT)
+        index.train(unit_vectors)
+    else:
+        raise ValueError(f"Unknown ANN index kind: {kind!r} (expected one of {INDEX_KINDS})")
+    index.add_with_ids(unit_vectors, template_ids)
+    set_search_params(index, config)
+    return index
+
+
+def set_search_params(index, config: dict):
+    """Apply the search-time knobs (efSearch / nprobe) of config to a built index."""
+    import faiss
+
+    params = config.get("params", {})
+    if config["kind"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = params["efSearch"]
+    elif config["kind"] in ("ivf", "ivfpq"):
+        index.nprobe = params["nprobe"]
+
+
+def index_bytes(index) -> int:
+    import faiss
+    return int(faiss.serialize_index(index).nbytes)
+
+
+class _ReadWriteLock:
+    """Many concurrent readers (searches) or one writer (in-place adds to the index)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class AnnIndex:
+    """
+    Approximate candidate search for a FaissStore.
+    - Holds a faiss index over template ids; built at gallery warm-up, before
+      the gallery reports ready
+    - Templates appended since the last search are added in place (excluding
+      concurrent searches only for that add); once too many indexed templates
+      were removed, a replacement is built in a background thread and swapped
+      in, with exact search used meanwhile
+    - Searches share the index concurrently and never hold the store's lock
+    - Only fetches candidates; the store re-scores them exactly (cosine) and
+      reduces per user, so recall depends only on candidate retrieval
+    """
+
+    def __init__(self, config: dict, dim: int):
+        self.config = config
+        self.dim = dim
+        self.candidates = int(config.get("candidates", 4))  # templates fetched per requested user
+        self._state = (None, -1)  # (index, highest template id in it), replaced as a whole
+        self._rw = _ReadWriteLock()
+        self._rebuilding = threading.Lock()
+        self.rebuilds = 0
+
+    @property
+    def index(self):
+        return self._state[0]
+
+    def reset(self):
+        """Forget the index (the store's rows were replaced)."""
+        with self._rw.write():
+            self._state = (None, -1)
+
+    def sync(self, vectors: np.ndarray, norms: np.ndarray, template_ids: np.ndarray, snapshot=None) -> bool:
+        """
+        Bring the index up to date with a snapshot of the store's rows; False when
+        exact search must be used instead. When a (re)build is needed it runs here,
+        or with snapshot (a callable returning fresh rows) in a background thread.
+        """
+        n = template_ids.shape[0]
+        if n < min_train_size(self.config):
+            return False
+        index, last_id = self._state
+        if index is None or self._stale(index, last_id, template_ids):
+            if snapshot is None:
+                return self.build(vectors, norms, template_ids)
+            self._rebuild_in_background(snapshot)
+            return False
+        if template_ids[-1] != last_id:
+            with self._rw.write():
+                index, last_id = self._state
+                indexed = int(np.searchsorted(template_ids, last_id, side="right"))
+                tail = template_ids[indexed:]
+                if tail.size and index is not None:
+                    if tail.size > 1 and not np.all(tail[1:] > tail[:-1]):
+                        return False
+                    index.add_with_ids(unit_rows(vectors[indexed:], norms[indexed:]), tail)
+                    self._state = (index, int(tail[-1]))
+        return True
+
+    def _stale(self, index, last_id, template_ids) -> bool:
+        indexed = int(np.searchsorted(template_ids, last_id, side="right"))
+        return index.ntotal - indexed > ANN_REBUILD_STALE * max(index.ntotal, 1)
+
+    def build(self, vectors: np.ndarray, norms: np.ndarray, template_ids: np.ndarray) -> bool:
+        """Build from a snapshot (searches go on meanwhile), then swap it in."""
+        if template_ids.shape[0] < min_train_size(self.config) or \
+                (template_ids.shape[0] > 1 and not np.all(template_ids[1:] > template_ids[:-1])):
+            return False
+        index = build_index(self.config, self.dim, unit_rows(vectors, norms), template_ids)
+        with self._rw.write():
+            self._state = (index, int(template_ids[-1]))
+        self.rebuilds += 1
+        return True
+
+    def _rebuild_in_background(self, snapshot):
+        if not self._rebuilding.acquire(blocking=False):
+            return  # already running
+
+        def run():
+            try:
+                self.build(*snapshot())
+            except Exception as e:
+                print(f"ERROR rebuilding ANN index: {str(e)}")
+            finally:
+                self._rebuilding.release()
+
+        threading.Thread(target=run, name="ann-rebuild", daemon=True).start()
+
+    def retune(self, config: dict):
+        """Switch to another config with the same build parameters without rebuilding."""
+        with self._rw.write():
+            self.config = config
+            self.candidates = int(config.get("candidates", 4))
+            if self.index is not None:
+                set_search_params(self.index, config)
+
+    def search(self, unit_queries: np.ndarray, n_candidates: int):
+        """(scores, template ids) of the n_candidates nearest templates per query; id -1 pads."""
+        with self._rw.read():
+            return self.index.search(unit_queries, n_candidates)
+
+    def nbytes(self) -> int:
+        index = self.index
+        return index_bytes(index) if index is not None else 0
+
+
+def unit_rows(vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    return np.divide(vectors, norms[:, None], out=np.zeros_like(vectors), where=norms[:, None] != 0)
+
+
+def load_ann_config(tenant: str, path: str = ANN_CONFIG_PATH) -> dict | None:
+    """The tuned config for a tenant's gallery; None (exact search) when there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        config = json.load(f).get("tenants", {}).get(tenant)
+    if config is None or config["kind"] == "exact":
+        return None
+    return config
+
+
+def save_ann_config(tenant: str, config: dict, path: str = ANN_CONFIG_PATH):
+    """Record a tenant's config, keeping the other tenants' entries."""
+    data = {"version": 1, "tenants": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data["tenants"][tenant] = {**config, "tuned_at": time.time()}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
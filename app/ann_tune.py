@@ -0,0 +1,194 @@
+# app/ann_tune.py
+"""
+Recall / latency / memory evaluation of ANN indexes for one gallery, and
+selection of the cheapest one that is accurate enough.
+
+    python -m app.ann_tune [--tenant site-a] [--gallery snapshot.json] [--probes probes.npy | image_dir]
+                           [--k 5] [--target-recall 0.99] [--target-recall-k 0.9] [--dry-run]
+
+Ground truth is the store's exact brute-force search (cosine, best template
+per user). Every config is evaluated through the store's own ANN path, so the
+numbers include candidate re-scoring. The chosen config is written for the
+tenant to ANN_CONFIG_PATH, which the server reads at gallery warm-up; "exact"
+(no index) wins when no index is both faster and accurate enough.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANN_TUNE_PROBES = int(os.getenv("ANN_TUNE_PROBES", "1000"))  # probes sampled from the gallery when none are given
+ANN_TUNE_NOISE = float(os.getenv("ANN_TUNE_NOISE", "0.3"))  # relative noise added to sampled probes
+ANN_TUNE_LATENCY_QUERIES = int(os.getenv("ANN_TUNE_LATENCY_QUERIES", "200"))  # single-query timings per config
+
+
+def candidate_configs(n_templates: int, dim: int) -> list[dict]:
+    """The sweep: brute force, faiss flat, HNSW, IVF-Flat and IVF-PQ over a small parameter grid."""
+    from app.ann import min_train_size
+
+    configs = [{"kind": "exact"}, {"kind": "flat", "candidates": 4}]
+    for m in (16, 32):
+        for ef in (16, 32, 64, 128):
+            for candidates in (2, 4):
+                configs.append({"kind": "hnsw", "params": {"M": m, "efSearch": ef}, "candidates": candidates})
+    root = max(int(np.sqrt(n_templates)), 1)
+    for nlist in sorted({root, 4 * root}):
+        for nprobe in (1, 2, 4, 8, 16, 32, 64):
+            if nprobe > nlist:
+                continue
+            configs.append({"kind": "ivf", "params": {"nlist": nlist, "nprobe": nprobe}, "candidates": 4})
+            for m in (16, 32):
+                if dim % m == 0:
+                    configs.append({"kind": "ivfpq", "params": {"nlist": nlist, "nprobe": nprobe, "m": m, "nbits": 8},
+                                    "candidates": 4})
+    return [c for c in configs if c["kind"] == "exact" or n_templates >= min_train_size(c)]
+
+
+def sample_probes(store, count: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Gallery templates plus Gaussian noise scaled to each template's norm (stand-in for fresh captures)."""
+    vectors = np.asarray([emb for _, emb in store.get_all_embeddings()], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    scale = noise * np.linalg.norm(picked, axis=1, keepdims=True) / np.sqrt(picked.shape[1])
+    return (picked + rng.standard_normal(picked.shape).astype(np.float32) * scale).astype(np.float32)
+
+
+def load_probes(path: str, version: int) -> np.ndarray:
+    """A .npy matrix of probe embeddings, or a directory of images embedded with the gallery's version."""
+    if os.path.isdir(path):
+        from app.fp_utils import load_fingerprint_image, embed_images
+        names = sorted(os.listdir(path))
+        return embed_images([load_fingerprint_image(os.path.join(path, name)) for name in names], version)
+    return np.load(path).astype(np.float32)
+
+
+def recall(results: list, truth: list, k: int) -> tuple[float, float]:
+    """(recall@1, recall@k) of result user lists against the ground truth ones."""
+    at_1 = at_k = 0.0
+    for found, expected in zip(results, truth):
+        found_ids = [uid for uid, _ in found]
+        expected_ids = [uid for uid, _ in expected[:k]]
+        at_1 += bool(found_ids) and found_ids[0] == expected_ids[0]
+        at_k += len(set(found_ids[:k]) & set(expected_ids)) / len(expected_ids)
+    return at_1 / len(truth), at_k / len(truth)
+
+
+def evaluate(store, config: dict, probes: np.ndarray, truth: list, k: int, latency_queries: int) -> dict:
+    """Recall and cost of one config, measured through the store's search path."""
+    store.enable_ann(None if config["kind"] == "exact" else config)
+    started = time.perf_counter()
+    store.build_ann()
+    build_seconds = time.perf_counter() - started
+
+    results = store.search_similar_batch(probes, k)
+    at_1, at_k = recall(results, truth, k)
+
+    timings = []
+    for probe in probes[:latency_queries]:
+        started = time.perf_counter()
+        store.search_similar_batch(probe[None, :], k)
+        timings.append(1000 * (time.perf_counter() - started))
+    started = time.perf_counter()
+    store.search_similar_batch(probes, k)
+    batched_ms = 1000 * (time.perf_counter() - started) / len(probes)
+
+    return {
+        **config,
+        "recall_at_1": round(at_1, 4),
+        "recall_at_k": round(at_k, 4),
+        "p50_ms": round(float(np.percentile(timings, 50)), 4),
+        "p95_ms": round(float(np.percentile(timings, 95)), 4),
+        "batched_ms_per_query": round(batched_ms, 4),
+        "index_bytes": store.ann_nbytes(),
+        "build_seconds": round(build_seconds, 3),
+    }
+
+
+def choose(rows: list, target_recall: float, target_recall_k: float | None = None) -> dict:
+    """Cheapest row (p50 latency, then index memory) meeting the recall@1 (and optional recall@k) target."""
+    eligible = [r for r in rows if r["recall_at_1"] >= target_recall
+                and (target_recall_k is None or r["recall_at_k"] >= target_recall_k)]
+    return min(eligible, key=lambda r: (r["p50_ms"], r["index_bytes"]))
+
+
+def tune(store, probes: np.ndarray, k: int = 5, target_recall: float = 0.99, target_recall_k: float | None = None,
+         latency_queries: int = ANN_TUNE_LATENCY_QUERIES, log=print) -> tuple[dict, list]:
+    """
+    Sweep candidate_configs over a loaded store. Returns (chosen row, all rows);
+    the store is left on brute force.
+    """
+    store.enable_ann(None)
+    truth = store.search_similar_batch(probes, k, reduce="max")
+    rows = []
+    for config in candidate_configs(store.count(), store.dim):
+        row = evaluate(store, config, probes, truth, k, latency_queries)
+        rows.append(row)
+        log(f"[ann] {row['kind']:<6} {json.dumps(row.get('params', {})):<48} cand={row.get('candidates', '-')} "
+            f"R@1={row['recall_at_1']:.4f} R@{k}={row['recall_at_k']:.4f} p50={row['p50_ms']:.3f}ms "
+            f"p95={row['p95_ms']:.3f}ms batched={row['batched_ms_per_query']:.3f}ms/q mem={row['index_bytes']}B")
+    store.enable_ann(None)
+    return choose(rows, target_recall, target_recall_k), rows
+
+
+def main(argv=None):
+    from app.models import DEFAULT_TENANT
+
+    parser = argparse.ArgumentParser(description="Evaluate ANN indexes for a gallery and save the cheapest accurate one")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT)
+    parser.add_argument("--gallery", help="gallery JSON snapshot (default: the tenant's gallery file)")
+    parser.add_argument("--probes", help=".npy probe embeddings or a directory of probe images "
+                                         "(default: noisy samples of the gallery)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--target-recall", type=float, default=0.99, help="required recall@1")
+    parser.add_argument("--target-recall-k", type=float, help="required recall@k (default: not enforced)")
+    parser.add_argument("--latency-queries", type=int, default=ANN_TUNE_LATENCY_QUERIES)
+    parser.add_argument("--config", help="config file to update (default: ANN_CONFIG_PATH)")
+    parser.add_argument("--report", help="write every measured config to this JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="report only; don't write the config")
+    args = parser.parse_args(argv)
+
+    from app.ann import ANN_CONFIG_PATH, save_ann_config
+    from app.faiss_store import FaissStore, JSON_PATH, SCORE_REDUCE
+    from app.gallery import GALLERY_DIR
+
+    gallery = args.gallery or (JSON_PATH if args.tenant == DEFAULT_TENANT
+                               else os.path.join(GALLERY_DIR, f"{args.tenant}.json"))
+    if not os.path.exists(gallery):
+        parser.error(f"gallery snapshot not found: {gallery}")
+    if SCORE_REDUCE != "max":
+        print(f"WARNING: SCORE_REDUCE={SCORE_REDUCE}; ANN indexes only serve 'max' searches", file=sys.stderr)
+
+    # Work on a copy: loading may rewrite legacy files
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "gallery.json")
+        shutil.copyfile(gallery, snapshot)
+        store = FaissStore(json_path=snapshot)
+        if store.count() == 0:
+            parser.error(f"gallery snapshot is empty: {gallery}")
+        probes = (load_probes(args.probes, store.embedding_version) if args.probes
+                  else sample_probes(store, ANN_TUNE_PROBES, ANN_TUNE_NOISE))
+        print(f"[ann] {store.count()} templates / {store.user_count()} users, {len(probes)} probes, "
+              f"target recall@1 {args.target_recall}, recall@{args.k} {args.target_recall_k}")
+        best, rows = tune(store, probes, args.k, args.target_recall, args.target_recall_k, args.latency_queries)
+
+    best = {**best, "k": args.k, "templates": store.count(), "embedding_version": store.embedding_version}
+    print(f"[ann] chosen for '{args.tenant}': {best['kind']} {best.get('params', {})} "
+          f"(R@1={best['recall_at_1']}, p50={best['p50_ms']}ms)")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"tenant": args.tenant, "chosen": best, "results": rows}, f, indent=2)
+    if not args.dry_run:
+        save_ann_config(args.tenant, best, args.config or ANN_CONFIG_PATH)
+        print(f"[ann] saved to {args.config or ANN_CONFIG_PATH}; restart the server to use it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# app/batching.py
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SEARCH_BATCHING_ENABLED = os.getenv("SEARCH_BATCHING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Longest a query waits for others to join its batch
+SEARCH_BATCH_WINDOW_MS = float(os.getenv("SEARCH_BATCH_WINDOW_MS", "2"))
+# A batch is searched as soon as it holds this many query rows
+SEARCH_MAX_BATCH = int(os.getenv("SEARCH_MAX_BATCH", "64"))
+
+
+class _Batch:
+    """Queries waiting to be searched against one store."""
+
+    def __init__(self, store):
+        self.store = store
+        self.entries = []  # (queries, k, future)
+        self.rows = 0
+        self.timer = None
+
+
+class SearchCoalescer:
+    """
+    Micro-batching of 1:N identification queries on the event loop.
+    - Queries arriving within window_ms of the first one (or until max_batch
+      rows are waiting) are stacked and searched with one search_similar_batch
+      call, so the gallery matrix is streamed once per batch, not per query
+    - Batches are per store (tenant partition, or a store swapped in by a
+      migration); a batch never mixes galleries
+    - Each caller gets back its own rows, trimmed to its own k
+    - Added latency is bounded by the window; a full batch goes immediately
+    - max_callers is how many searching requests can be in flight at once (the
+      admission limits of the searching endpoints); once that many wait, nobody
+      else can join, so the batch goes without waiting out the window
+    """
+
+    def __init__(self, window_ms: float = SEARCH_BATCH_WINDOW_MS, max_batch: int = SEARCH_MAX_BATCH,
+                 enabled: bool = SEARCH_BATCHING_ENABLED, max_callers: int | None = None):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_callers = max_callers
+        self.enabled = enabled
+        self._pending = {}  # id(store) -> _Batch
+        self.batches = 0
+        self.queries = 0
+        self.max_batch_seen = 0
+        self.search_seconds = 0.0
+
+    async def search(self, store, queries, k: int = 1) -> list:
+        """search_similar_batch(queries, k) on `store`, coalesced with concurrent callers."""
+        import numpy as np  # lazily: app.main imports this module
+
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, store.dim)
+        loop = asyncio.get_running_loop()
+        key = id(store)  # the pending batch keeps the store alive, so ids are not reused
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(store)
+
+        future = loop.create_future()
+        batch.entries.append((queries, k, future))
+        batch.rows += queries.shape[0]
+        if batch.rows >= self.max_batch or len(batch.entries) == self.max_callers:
+            self._flush(key)
+        elif batch.timer is None:
+            batch.timer = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def search_from_thread(self, store, queries, k: int = 1) -> list:
+        """search() for sync handlers running in the threadpool; direct search otherwise (scripts, tests)."""
+        import anyio.from_thread
+
+        # Set only in AnyIO worker threads, i.e. while an event loop is there to batch on
+        if self.enabled and getattr(anyio.from_thread.threadlocals, "current_token", None) is not None:
+            return anyio.from_thread.run(self.search, store, queries, k)
+        return store.search_similar_batch(queries, k)
+
+    def _flush(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        asyncio.get_running_loop().create_task(self._run(batch.store, batch.entries))
+
+    async def _run(self, store, batch):
+        import numpy as np
+
+        stacked = np.concatenate([queries for queries, _, _ in batch])
+        k = max(k for _, k, _ in batch)
+        started = time.perf_counter()
+        try:
+            # Off the event loop: the matrix product releases the GIL
+            results = await asyncio.get_running_loop().run_in_executor(None, store.search_similar_batch, stacked, k)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.queries += stacked.shape[0]
+        self.max_batch_seen = max(self.max_batch_seen, stacked.shape[0])
+        self.search_seconds += time.perf_counter() - started
+
+        offset = 0
+        for queries, k, future in batch:
+            rows = results[offset:offset + queries.shape[0]]
+            offset += queries.shape[0]
+            if not future.done():
+                future.set_result([row[:k] for row in rows])
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "max_callers": self.max_callers,
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 3) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "avg_search_ms": round(1000 * self.search_seconds / self.batches, 3) if self.batches else 0.0,
+        }
@@ -0,0 +1,47 @@
+# app/embedding_io.py
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBED_DIM = int(os.getenv("EMBED_DIM", "128"))
+# Most vectors accepted in one application/octet-stream body
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "256"))
+# Templates are the first 128 features of a unit-norm 2048-d vector, so their
+# norm is in (0, 1]; anything else was not produced by our extractor.
+NORM_TOLERANCE = 1e-3
+
+OCTET_STREAM = "application/octet-stream"
+WIRE_DTYPE = np.dtype("<f4")  # little-endian float32
+
+
+class EmbeddingFormatError(ValueError):
+    """Raised when a binary embedding body is malformed."""
+
+
+def parse_embeddings(body: bytes, dim: int = EMBED_DIM, max_batch: int = EMBEDDING_MAX_BATCH) -> np.ndarray:
+    """
+    Parse a raw little-endian float32 body into a (n, dim) matrix, zero-copy.
+    The returned array is a read-only view over the request bytes.
+    """
+    row_bytes = dim * WIRE_DTYPE.itemsize
+    if not body or len(body) % row_bytes:
+        raise EmbeddingFormatError(
+            f"Body must hold a whole number of {dim}-d float32 vectors ({row_bytes} bytes each), got {len(body)} bytes"
+        )
+    n = len(body) // row_bytes
+    if n > max_batch:
+        raise EmbeddingFormatError(f"At most {max_batch} vectors per request, got {n}")
+
+    vectors = np.frombuffer(body, dtype=WIRE_DTYPE).reshape(n, dim)
+    if not np.isfinite(vectors).all():
+        raise EmbeddingFormatError("Embedding contains NaN or infinite values")
+
+    norms = np.linalg.norm(vectors, axis=1)
+    bad = np.flatnonzero((norms <= 0) | (norms > 1 + NORM_TOLERANCE))
+    if bad.size:
+        raise EmbeddingFormatError(f"Embedding {int(bad[0])} has norm {float(norms[bad[0]]):.4f}, expected (0, 1]")
+
+    # Native float32 on little-endian hosts: still a view, no copy
+    return vectors.astype(np.float32, copy=False)
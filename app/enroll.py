@@ -0,0 +1,344 @@
+# app/enroll.py
+"""
+Offline bulk enrollment from a manifest of fingerprint scans.
+
+    python -m app.enroll manifest.csv [--tenant site-a] [--chunk-size 1000] [--workers 8]
+
+The manifest is a CSV with columns name, age, password and image (one path) or
+images (several paths separated by ';'); relative paths are resolved against
+the manifest's directory. Run it with the API stopped: it writes the same
+database and gallery files the server loads at startup.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENROLL_CHUNK_SIZE = int(os.getenv("ENROLL_CHUNK_SIZE", "1000"))  # manifest rows per transaction
+ENROLL_WORKERS = int(os.getenv("ENROLL_WORKERS", "0"))  # 0 = one per core
+# Gallery JSON + checkpoint write interval; each write is O(gallery size)
+ENROLL_CHECKPOINT_SECONDS = float(os.getenv("ENROLL_CHECKPOINT_SECONDS", "60"))
+
+REPORT_FIELDS = ["row", "status", "code", "message"]  # row: 1-based data row of the manifest
+
+
+def read_manifest(path: str, skip: int = 0):
+    """Stream (row_number, entry) pairs from the manifest (rows numbered from 1), skipping the first `skip` rows."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        for row_number, row in enumerate(itertools.islice(csv.DictReader(f), skip, None), start=skip + 1):
+            images = row.get("images") or row.get("image") or ""
+            entry = {
+                "name": (row.get("name") or "").strip(),
+                "age": (row.get("age") or "").strip(),
+                "password": row.get("password") or "",
+                "image_paths": [os.path.join(base, p.strip()) for p in images.split(";") if p.strip()],
+            }
+            yield row_number, entry
+
+
+def count_rows(path: str) -> int:
+    with open(path, newline="") as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+def manifest_digest(path: str, tenant: str) -> str:
+    """Identity of a manifest's content for one tenant; row keys (User.enroll_key) derive from it."""
+    digest = hashlib.sha256(tenant.encode("utf-8") + b"\0")
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:48]
+
+
+def _extract(entries: list, version: int) -> list:
+    """
+    Worker task: load, quality-check, embed and PNG-encode the images of some entries.
+    Returns one result dict per entry; sources are only retained once the row is committed.
+    """
+    from app.fp_utils import load_fingerprint_image, embed_images
+    from app.quality import QualityError, check_quality
+    from app.sources import SourceImageStore
+
+    results = []
+    for row_number, entry in entries:
+        try:
+            if not entry["name"] or not entry["image_paths"]:
+                raise ValueError("Row needs a name and at least one image")
+            int(entry["age"])
+            images = [load_fingerprint_image(path) for path in entry["image_paths"]]
+            for image in images:
+                check_quality(image)
+            results.append({
+                "row": row_number, "status": "ok",
+                "embeddings": embed_images(images, version),
+                "sources": [SourceImageStore.encode(image) for image in images],
+            })
+        except QualityError as e:
+            results.append({"row": row_number, "status": "rejected", "code": e.code, "message": str(e)})
+        except Exception as e:
+            results.append({"row": row_number, "status": "error", "message": str(e)})
+    return results
+
+
+class Checkpoint:
+    """Progress of one manifest, rewritten atomically at every gallery write."""
+
+    def __init__(self, path: str, tenant: str):
+        self.path = path
+        self.tenant = tenant
+        self.state = {"tenant": tenant, "rows_done": 0, "enrolled": 0, "duplicate": 0, "rejected": 0, "error": 0}
+
+    def load(self, restart: bool = False) -> dict:
+        if os.path.exists(self.path) and not restart:
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get("tenant") != self.tenant:
+                raise ValueError(f"Checkpoint {self.path} is for tenant {state.get('tenant')!r}, not {self.tenant!r}")
+            self.state.update(state)
+        return self.state
+
+    def save(self):
+        self.state["updated_at"] = time.time()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+class EnrollmentRun:
+    """
+    Chunked, resumable enrollment of a manifest into one tenant's gallery.
+    - Rows are streamed; each chunk is embedded on a process pool while the
+      previous one is being written
+    - Per chunk: duplicate checks (gallery + within the chunk, as /register/bulk),
+      then users and templates in one transaction, then the rows' source images
+    - The gallery JSON, the report and the checkpoint are written every
+      checkpoint_seconds and at the end, not per chunk
+    - Each user stores its manifest row key (User.enroll_key). Rows replayed
+      after a crash are recognized by it and keep their user; templates the
+      gallery lost with the crash are restored
+    - Rejected, duplicate and failed rows go to a CSV report
+    """
+
+    def __init__(self, manifest: str, session_factory, store, source_store, tenant: str,
+                 chunk_size: int = ENROLL_CHUNK_SIZE, workers: int = ENROLL_WORKERS,
+                 checkpoint_path: str | None = None, report_path: str | None = None, log=print,
+                 checkpoint_seconds: float = ENROLL_CHECKPOINT_SECONDS):
+        self.manifest = manifest
+        self.session_factory = session_factory
+        self.store = store
+        self.source_store = source_store
+        self.tenant = tenant
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+        self.checkpoint = Checkpoint(checkpoint_path or f"{manifest}.checkpoint.json", tenant)
+        self.report_path = report_path or f"{manifest}.report.csv"
+        self.log = log
+        self.checkpoint_seconds = checkpoint_seconds
+        self.images = 0
+        self._report = []  # report rows since the last checkpoint
+        self._dirty = False  # chunks written since the last checkpoint
+        self._checkpointed_at = time.monotonic()
+        self._digest = None
+
+    def run(self, restart: bool = False, max_chunks: int | None = None) -> dict:
+        from app.fp_utils import init_worker
+
+        state = self.checkpoint.load(restart)
+        self._digest = manifest_digest(self.manifest, self.tenant)
+        if restart and os.path.exists(self.report_path):
+            os.remove(self.report_path)
+        total = count_rows(self.manifest)
+        start_rows = state["rows_done"]
+        if start_rows:
+            self.log(f"[enroll] resuming {self.manifest} at row {start_rows}/{total}")
+
+        rows = read_manifest(self.manifest, skip=start_rows)
+        chunks = iter(lambda: list(itertools.islice(rows, self.chunk_size)), [])
+        if max_chunks is not None:
+            chunks = itertools.islice(chunks, max_chunks)
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker) as pool:
+            pending = None
+            for chunk in itertools.chain(chunks, [None]):
+                # Submit the next chunk before writing the current one
+                submitted = (chunk, self._submit(pool, chunk)) if chunk else None
+                if pending is not None:
+                    done_chunk, futures = pending
+                    results = [r for future in futures for r in future.result()]
+                    self._write_chunk(done_chunk, results)
+                    if time.monotonic() - self._checkpointed_at >= self.checkpoint_seconds:
+                        self._checkpoint()
+                    self._report_progress(start_rows, total, started)
+                pending = submitted
+        self._checkpoint()
+        return state
+
+    def row_key(self, row_number: int) -> str:
+        return f"{self._digest}:{row_number}"
+
+    def _checkpoint(self):
+        """Persist the gallery, then the report and progress of every chunk written since the last call."""
+        if not self._dirty:
+            return
+        self.store.save()
+        self._append_report(self._report)
+        self._report = []
+        self.checkpoint.save()
+        self._dirty = False
+        self._checkpointed_at = time.monotonic()
+
+    def _submit(self, pool, chunk):
+        per_task = -(-len(chunk) // self.workers)
+        return [pool.submit(_extract, chunk[i:i + per_task], self.store.embedding_version)
+                for i in range(0, len(chunk), per_task)]
+
+    def _write_chunk(self, chunk, results):
+        import numpy as np
+        from app.faiss_store import duplicates_within_batch
+        from app.models import User
+        from app.users import build_user_record
+
+        entries = dict(chunk)
+        state = self.checkpoint.state
+        report = self._report
+        ok = [r for r in results if r["status"] == "ok"]
+        for r in results:
+            if r["status"] != "ok":
+                state[r["status"]] += 1
+                report.append({"row": r["row"], "status": r["status"], "code": r.get("code"), "message": r["message"]})
+
+        db = self.session_factory()
+        try:
+            # Rows already committed by a run that crashed before its checkpoint
+            enrolled = dict(db.query(User.enroll_key, User.user_id)
+                            .filter(User.enroll_key.in_([self.row_key(r["row"]) for r in ok])))
+            resumed = [r for r in ok if self.row_key(r["row"]) in enrolled]
+            if resumed:
+                owners = [enrolled[self.row_key(r["row"])] for r in resumed]
+                in_gallery = set(self.store.user_ids())
+                lost = [(r, uid) for r, uid in zip(resumed, owners) if uid not in in_gallery]
+                if lost:
+                    self.store.add_batch(np.concatenate([r["embeddings"] for r, _ in lost]),
+                                         [uid for r, uid in lost for _ in r["embeddings"]],
+                                         [key for r, _ in lost for key, _ in r["sources"]], save=False)
+            fresh = [r for r in ok if self.row_key(r["row"]) not in enrolled]
+
+            accepted = []
+            if fresh:
+                rows = np.concatenate([r["embeddings"] for r in fresh])
+                groups = np.repeat(np.arange(len(fresh)), [len(r["embeddings"]) for r in fresh])
+                gallery_hits = {}
+                for group, hit in zip(groups.tolist(), self.store.find_duplicates(rows)):
+                    if hit is not None:
+                        gallery_hits.setdefault(group, hit)
+                batch_hits = duplicates_within_batch(rows, groups, rejected=gallery_hits.keys())
+                for group, r in enumerate(fresh):
+                    if group in gallery_hits:
+                        message = f"Fingerprint is already enrolled as user {gallery_hits[group][0]}"
+                    elif batch_hits[group] is not None:
+                        message = f"Fingerprint duplicates row {fresh[batch_hits[group][0]]['row']}"
+                    else:
+                        accepted.append(r)
+                        continue
+                    state["duplicate"] += 1
+                    report.append({"row": r["row"], "status": "duplicate", "message": message})
+
+            if accepted:
+                version = self.store.embedding_version
+                users = []
+                for r in accepted:
+                    entry = entries[r["row"]]
+                    user = build_user_record(entry["name"], int(entry["age"]), entry["password"],
+                                             r["embeddings"][0], version, self.tenant)
+                    user.enroll_key = self.row_key(r["row"])
+                    users.append(user)
+                db.add_all(users)
+                db.flush()  # assigns user ids; nothing is visible until the commit
+                owners = [user.user_id for user, r in zip(users, accepted) for _ in r["embeddings"]]
+                self.store.add_batch(np.concatenate([r["embeddings"] for r in accepted]), owners,
+                                     [key for r in accepted for key, _ in r["sources"]], save=False)
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # Only committed rows keep their source images
+        for r in resumed + accepted:
+            for key, data in r["sources"]:
+                self.source_store.put_encoded(key, data)
+        state["enrolled"] += len(resumed) + len(accepted)
+        self.images += sum(len(entries[r["row"]]["image_paths"]) for r in results)
+        state["rows_done"] += len(chunk)
+        self._dirty = True
+
+    def _append_report(self, report):
+        if not report:
+            return
+        new_file = not os.path.exists(self.report_path)
+        with open(self.report_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(sorted(report, key=lambda r: r["row"]))
+
+    def _report_progress(self, start_rows: int, total: int, started: float):
+        state = self.checkpoint.state
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        rows_per_second = (state["rows_done"] - start_rows) / elapsed
+        eta = (total - state["rows_done"]) / rows_per_second if rows_per_second else 0.0
+        self.log(f"[enroll] rows {state['rows_done']}/{total} | enrolled {state['enrolled']} "
+                 f"duplicate {state['duplicate']} rejected {state['rejected']} error {state['error']} | "
+                 f"{rows_per_second:.1f} rows/s {self.images / elapsed:.1f} images/s | ETA {eta:.0f}s")
+
+
+def main(argv=None):
+    from app.models import DEFAULT_TENANT
+
+    parser = argparse.ArgumentParser(description="Resumable offline enrollment from a CSV manifest")
+    parser.add_argument("manifest")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT)
+    parser.add_argument("--chunk-size", type=int, default=ENROLL_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=ENROLL_WORKERS)
+    parser.add_argument("--checkpoint", help="default: <manifest>.checkpoint.json")
+    parser.add_argument("--report", help="default: <manifest>.report.csv")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+
+    from app.db import SessionLocal, init_db
+    from app.gallery import GalleryLoader, TENANT_PATTERN
+    from app.models import Base
+    from app.sources import SourceImageStore
+
+    if not TENANT_PATTERN.match(args.tenant):
+        parser.error("--tenant must be 1-64 letters, digits, '-' or '_'")
+
+    # Same warm-up as the server: schema, then galleries minus templates of missing users
+    gallery = GalleryLoader(SessionLocal, init_schema=lambda: init_db(Base))
+    gallery.run()
+    if not gallery.ready:
+        print(f"ERROR: cannot load gallery: {gallery.error}", file=sys.stderr)
+        return 1
+
+    run = EnrollmentRun(args.manifest, SessionLocal, gallery.partition(args.tenant, create=True).store,
+                        SourceImageStore(), args.tenant, chunk_size=args.chunk_size, workers=args.workers,
+                        checkpoint_path=args.checkpoint, report_path=args.report)
+    state = run.run(restart=args.restart)
+    print(json.dumps(state, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
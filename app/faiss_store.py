@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import tempfile
 import numpy as np
 from threading import Lock
 from dotenv import load_dotenv
@@ -10,22 +12,168 @@ load_dotenv()
 
 JSON_PATH = os.getenv("FAISS_JSON_PATH", "./data/embeddings.json")
 EMBED_DIM = int(os.getenv("EMBED_DIM", "128"))
+SCORE_REDUCE = os.getenv("SCORE_REDUCE", "max")  # how template scores combine per user: max | mean
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.98"))  # cosine score treated as same finger
+
+STORE_FORMAT_VERSION = 3
+# Embedding algorithm version assumed for files written before versioning
+LEGACY_EMBEDDING_VERSION = 1
+
+
+def group_by_user(user_ids: np.ndarray):
+    """
+    Segment layout for a (possibly unsorted) array of per-template user ids.
+    Returns (order, starts, counts, group_user_ids) such that
+    user_ids[order][starts[i]:starts[i] + counts[i]] all equal group_user_ids[i].
+    """
+    order = np.argsort(user_ids, kind="stable")
+    sorted_ids = user_ids[order]
+    if sorted_ids.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return order, empty, empty, empty
+    boundary = np.empty(sorted_ids.size, dtype=bool)
+    boundary[0] = True
+    np.not_equal(sorted_ids[1:], sorted_ids[:-1], out=boundary[1:])
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, sorted_ids.size))
+    return order, starts, counts, sorted_ids[starts]
+
+
+def reduce_by_user(scores: np.ndarray, grouping, how: str = "max") -> np.ndarray:
+    """
+    Segment-reduce template scores (..., n_templates) to user scores (..., n_users)
+    with a single ufunc.reduceat over the last axis — no per-user Python loop.
+    """
+    order, starts, counts, _ = grouping
+    ordered = scores[..., order]
+    if how == "max":
+        return np.maximum.reduceat(ordered, starts, axis=-1)
+    if how == "mean":
+        return np.add.reduceat(ordered, starts, axis=-1) / counts
+    raise ValueError(f"Unknown score reduction: {how!r} (expected 'max' or 'mean')")
+
+
+def duplicates_within_batch(embeddings, groups=None, threshold: float = DUPLICATE_THRESHOLD, rejected=()):
+    """
+    Detect near-duplicates inside a batch with one similarity matrix.
+    - groups: optional group index per row (e.g. the registration each image belongs
+      to); rows of the same group never conflict. Defaults to one group per row.
+    - rejected: groups already turned down for another reason (e.g. duplicates of
+      the gallery); nothing is reported as a duplicate of them
+    Returns, per group, None or (earlier_group, similarity_score) for the first
+    earlier accepted group it duplicates, so the first occurrence is the one kept.
+    A group is only compared with earlier groups that were themselves accepted.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors.reshape(vectors.shape[0], -1)
+    groups = np.arange(vectors.shape[0]) if groups is None else np.asarray(groups)
+    n_groups = int(groups.max()) + 1 if groups.size else 0
+
+    norms = np.linalg.norm(vectors, axis=1)
+    unit = np.divide(vectors, norms[:, None], out=np.zeros_like(vectors), where=norms[:, None] != 0)
+    sim = unit @ unit.T
+    hits = sim >= threshold
+
+    # Groups in order; a row can only be matched once its group was accepted
+    rejected = set(rejected)
+    accepted_rows = np.zeros(vectors.shape[0], dtype=bool)
+    result = [None] * n_groups
+    for g in range(n_groups):
+        cols = np.flatnonzero(groups == g)
+        if g in rejected or not cols.size:
+            continue
+        block = hits[:, cols] & accepted_rows[:, None]
+        if block.any():
+            col = int(block.any(axis=0).argmax())  # first conflicting row of the group
+            row = int(block[:, col].argmax())  # earliest accepted row it matches
+            result[g] = (int(groups[row]), float(sim[row, cols[col]]))
+        else:
+            accepted_rows[cols] = True
+    return result
 
 
 class FaissStore:
     """
     Simplified JSON-based embedding store.
-    - Keeps user_id → embedding mapping
+    - Keeps template_id → (user_id, embedding); a user may own many templates
+      (several fingers / scans), all held in one contiguous float32 matrix
+    - Every template carries the key of its retained source image (if any), and
+      the whole gallery is tagged with the embedding algorithm version
     - Generates AES key from (embedding + password)
     - Persists everything in embeddings.json
+    - Optionally answers 1:N searches from an approximate index (app/ann.py)
+      whose candidates are re-scored exactly; brute force otherwise
     """
 
-    def __init__(self, dim: int = EMBED_DIM):
+    def __init__(self, dim: int = EMBED_DIM, json_path: str = JSON_PATH, load: bool = True,
+                 embedding_version: int = LEGACY_EMBEDDING_VERSION):
         self.dim = dim
+        self.json_path = json_path
+        self.embedding_version = embedding_version  # replaced by the file's version on load
         self.lock = Lock()
-        os.makedirs(os.path.dirname(JSON_PATH), exist_ok=True)
-        self.data = self._load_json()
-        print(f"Loaded {len(self.data)} embeddings from {JSON_PATH}")
+        self._save_lock = Lock()  # serializes save(); the JSON itself is built outside self.lock
+        # Held by registrations from their duplicate check until their templates are
+        # added (app/main.py); searches don't take it
+        self.enroll_lock = Lock()
+        self._mutations = 0  # bumped by every change to the rows (see retire)
+        self._successor = None  # set once a migration has cut over to a new store
+        self._reembed = None
+        self.searched = 0  # query rows scored against this gallery
+        self.search_seconds = 0.0
+        self._ann = None  # AnnIndex, see enable_ann()
+        self._clear()
+        os.makedirs(os.path.dirname(self.json_path) or ".", exist_ok=True)
+        if load:
+            self.load()
+
+    def _clear(self):
+        self._mutations += 1
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._template_ids = np.empty(0, dtype=np.int64)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._sources = np.empty(0, dtype=object)
+        self._size = 0
+        self._next_template_id = 1
+        self._grouping = None
+        if self._ann is not None:
+            self._ann.reset()
+
+    def load(self, keep_user_ids=None, progress=None, chunk_size: int = 1000):
+        """
+        Load persisted templates from JSON.
+        - keep_user_ids: optional set of user ids; templates of other users are
+          dropped (and the file rewritten) so the store stays in sync with the DB
+        - progress: optional callback(loaded, total) invoked every chunk_size entries
+        """
+        raw = self._load_json()
+        records = raw["templates"]
+        total = len(records)
+        if progress:
+            progress(0, total)
+
+        with self.lock:
+            self._clear()
+            self._next_template_id = raw["next_template_id"]
+            if raw["embedding_version"] is not None:
+                self.embedding_version = raw["embedding_version"]
+            for i in range(0, total, chunk_size):
+                chunk = [r for r in records[i:i + chunk_size]
+                         if keep_user_ids is None or int(r["user_id"]) in keep_user_ids]
+                if chunk:
+                    self._append(
+                        np.asarray([r["embedding"] for r in chunk], dtype=np.float32).reshape(-1, self.dim),
+                        np.asarray([r["user_id"] for r in chunk], dtype=np.int64),
+                        np.asarray([r["template_id"] for r in chunk], dtype=np.int64),
+                        [r.get("source") for r in chunk],
+                    )
+                if progress:
+                    progress(min(i + chunk_size, total), total)
+        if self._size != total or raw["legacy"]:
+            self.save()
+        print(f"Loaded {self._size} templates (embedding v{self.embedding_version}) from {self.json_path} "
+              f"({total - self._size} stale dropped)")
+        return self._size
 
     # ------------------------------------------------
     # Core operations
@@ -33,28 +181,262 @@ class FaissStore:
     def reset_index(self):
         """Clear all stored embeddings from JSON."""
         with self.lock:
-            self.data = {}
-            if os.path.exists(JSON_PATH):
-                os.remove(JSON_PATH)
+            self._clear()
+            if os.path.exists(self.json_path):
+                os.remove(self.json_path)
             print("Cleared all stored embeddings.")
 
-    def add(self, embedding, user_id: int):
-        """Add new embedding to JSON store."""
-        try:
-            vec = np.asarray(embedding, dtype=np.float32).flatten().tolist()
-            if len(vec) != self.dim:
-                raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {len(vec)}")
+    def _as_matrix(self, embeddings) -> np.ndarray:
+        mat = np.asarray(embeddings, dtype=np.float32)
+        if mat.ndim == 1:
+            mat = mat.reshape(1, -1)
+        mat = mat.reshape(mat.shape[0], -1)
+        if mat.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {mat.shape[1]}")
+        return mat
+
+    def _append(self, vectors: np.ndarray, user_ids: np.ndarray, template_ids: np.ndarray, sources=None):
+        """Append rows, growing the backing arrays geometrically. Caller holds the lock."""
+        n = vectors.shape[0]
+        needed = self._size + n
+        if needed > self._vectors.shape[0]:
+            capacity = max(needed, 2 * self._vectors.shape[0], 64)
+            self._vectors = self._grow(self._vectors, capacity)
+            self._norms = self._grow(self._norms, capacity)
+            self._template_ids = self._grow(self._template_ids, capacity)
+            self._user_ids = self._grow(self._user_ids, capacity)
+            self._sources = self._grow(self._sources, capacity)
+        end = self._size + n
+        self._vectors[self._size:end] = vectors
+        self._norms[self._size:end] = np.linalg.norm(vectors, axis=1)
+        self._template_ids[self._size:end] = template_ids
+        self._user_ids[self._size:end] = user_ids
+        self._sources[self._size:end] = [None] * n if sources is None else list(sources)
+        self._size = end
+        self._mutations += 1
+        self._next_template_id = max(self._next_template_id, int(template_ids.max()) + 1)
+        self._grouping = None
+
+    def _grow(self, arr: np.ndarray, capacity: int) -> np.ndarray:
+        grown = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+        grown[:self._size] = arr[:self._size]
+        return grown
 
+    def add_batch(self, embeddings, user_ids, sources=None, save: bool = True) -> list[int]:
+        """
+        Add many templates (row i owned by user_ids[i]) with a single JSON write.
+        - sources: optional retained source image key per row (see app/sources.py)
+        - save=False skips the JSON write; the caller persists later with save()
+        Returns their template ids.
+        """
+        try:
+            vectors = self._as_matrix(embeddings)
+            owners = np.asarray(user_ids, dtype=np.int64).reshape(-1)
+            if owners.shape[0] != vectors.shape[0]:
+                raise ValueError(f"Got {vectors.shape[0]} embeddings but {owners.shape[0]} user ids")
+            if sources is not None and len(sources) != vectors.shape[0]:
+                raise ValueError(f"Got {vectors.shape[0]} embeddings but {len(sources)} sources")
             with self.lock:
-                self.data[str(user_id)] = vec
-                print(f"DEBUG: Added user_id={user_id} to data dict")
-                self._save_json()
-                print(f"DEBUG: Saved to JSON file")
-            print(f"Added embedding for user_id={user_id}")
+                successor = self._successor
+                if successor is None:
+                    first = self._next_template_id
+                    template_ids = np.arange(first, first + vectors.shape[0], dtype=np.int64)
+                    self._append(vectors, owners, template_ids, sources)
+            if successor is None:
+                if save:
+                    self.save()
+            else:
+                # Retired by a migration: the embeddings are of the old version,
+                # so re-embed from the sources into the store that replaced us
+                if sources is None or any(source is None for source in sources):
+                    raise ValueError("Gallery was migrated; templates without a source image cannot be added")
+                return successor.add_batch(self._reembed(sources), owners, sources, save)
+            print(f"Added {len(template_ids)} template(s) for {len(np.unique(owners))} user(s)")
+            return template_ids.tolist()
         except Exception as e:
-            print(f"ERROR in FaissStore.add: {str(e)}")
+            print(f"ERROR in FaissStore.add_batch: {str(e)}")
             raise
 
+    def add_templates(self, embeddings, user_id: int, sources=None) -> list[int]:
+        """Add one or more templates for a user; returns their template ids."""
+        vectors = self._as_matrix(embeddings)
+        return self.add_batch(vectors, np.full(vectors.shape[0], user_id, dtype=np.int64), sources)
+
+    def add(self, embedding, user_id: int) -> int:
+        """Add a single template to the JSON store; returns its template id."""
+        return self.add_templates(embedding, user_id)[0]
+
+    def _keep_rows(self, keep: np.ndarray) -> int:
+        """Drop rows where keep is False; returns how many were removed. Caller holds the lock."""
+        removed = int(self._size - keep.sum())
+        if removed:
+            self._vectors = self._vectors[:self._size][keep]
+            self._norms = self._norms[:self._size][keep]
+            self._template_ids = self._template_ids[:self._size][keep]
+            self._user_ids = self._user_ids[:self._size][keep]
+            self._sources = self._sources[:self._size][keep]
+            self._size = self._vectors.shape[0]
+            self._grouping = None
+            self._mutations += 1
+        return removed
+
+    def remove_user(self, user_id: int) -> int:
+        """Drop every template of a user; returns how many were removed."""
+        with self.lock:
+            successor = self._successor
+            if successor is None:
+                removed = self._keep_rows(self._user_ids[:self._size] != user_id)
+        if successor is not None:
+            return successor.remove_user(user_id)
+        if removed:
+            self.save()
+        return removed
+
+    # ------------------------------------------------
+    # Migration support (see app/migration.py)
+    # ------------------------------------------------
+    def template_records(self):
+        """Copies of (template_ids, user_ids, sources) for every template."""
+        with self.lock:
+            n = self._size
+            return self._template_ids[:n].copy(), self._user_ids[:n].copy(), self._sources[:n].copy()
+
+    def import_templates(self, embeddings, user_ids, template_ids, sources=None):
+        """Add templates keeping their existing ids; not persisted until save()."""
+        vectors = self._as_matrix(embeddings)
+        with self.lock:
+            self._append(vectors, np.asarray(user_ids, dtype=np.int64), np.asarray(template_ids, dtype=np.int64), sources)
+
+    def drop_templates(self, template_ids) -> int:
+        """Remove templates by id; not persisted until save()."""
+        with self.lock:
+            return self._keep_rows(~np.isin(self._template_ids[:self._size], np.asarray(template_ids, dtype=np.int64)))
+
+    @property
+    def mutations(self) -> int:
+        """Change counter: read it before template_records() to detect later writes."""
+        return self._mutations
+
+    def retire(self, successor, reembed, staged: str | None = None, expected_mutations: int | None = None,
+               sync=None) -> bool:
+        """
+        Hand this store over to `successor` (a store of another embedding version).
+        - expected_mutations: only cut over if no write landed since the caller read
+          `mutations`; returns False otherwise (catch up and retry)
+        - staged: the successor's JSON, already written by successor.write_snapshot();
+          it replaces ours with a rename under the lock. Without it the successor is
+          saved after the handover. Either way no JSON is built under our lock.
+        - sync(template_ids, user_ids, sources) runs under our lock: a forced final
+          catch-up for when writes never stop long enough
+        - later add/remove calls are forwarded; added templates are re-embedded
+          from their sources with reembed(sources)
+        """
+        try:
+            with self.lock:
+                if expected_mutations is not None and self._mutations != expected_mutations:
+                    return False
+                if sync is not None:
+                    n = self._size
+                    sync(self._template_ids[:n].copy(), self._user_ids[:n].copy(), self._sources[:n].copy())
+                # Never hand out an id this store already used, even for deleted templates
+                with successor.lock:
+                    changed = sync is not None or successor._next_template_id < self._next_template_id
+                    successor._next_template_id = max(successor._next_template_id, self._next_template_id)
+                persisted = staged is not None and not changed  # else the staged file is outdated
+                if persisted:
+                    os.replace(staged, self.json_path)
+                    staged = None
+                self._successor = successor
+                self._reembed = reembed
+            if not persisted:
+                successor.save()
+            return True
+        finally:
+            if staged is not None and os.path.exists(staged):
+                os.remove(staged)
+
+    @property
+    def retired(self) -> bool:
+        return self._successor is not None
+
+    # ------------------------------------------------
+    # Approximate search (see app/ann.py, tuned by app/ann_tune.py)
+    # ------------------------------------------------
+    def enable_ann(self, config: dict | None):
+        """
+        Serve max-reduced 1:N searches from an ANN index built from config; None = brute force.
+        A config differing only in search-time knobs reuses the current index.
+        """
+        from app.ann import AnnIndex, build_params
+
+        with self.lock:
+            if config is not None and self._ann is not None and build_params(config) == build_params(self._ann.config):
+                self._ann.retune(config)
+            else:
+                self._ann = AnnIndex(config, self.dim) if config is not None else None
+
+    @property
+    def ann_config(self) -> dict | None:
+        return self._ann.config if self._ann is not None else None
+
+    def ann_nbytes(self) -> int:
+        """Memory of the ANN index on top of the template matrix (0 for brute force)."""
+        return self._ann.nbytes() if self._ann is not None else 0
+
+    def _rows(self):
+        """Consistent views of the live rows: (vectors, norms, template ids)."""
+        with self.lock:
+            n = self._size
+            return self._vectors[:n], self._norms[:n], self._template_ids[:n]
+
+    def build_ann(self) -> bool:
+        """
+        Build the ANN index from the current rows now, without holding the lock
+        (GalleryLoader calls this before the gallery reports ready). False when
+        brute force will serve instead (no index configured or too few templates).
+        """
+        if self._ann is None:
+            return False
+        return self._ann.sync(*self._rows())
+
+    def _ann_search(self, queries: np.ndarray, k: int):
+        """
+        Top-k users per query from ANN candidates re-scored by exact cosine.
+        Returns None when the index can't serve (e.g. gallery too small to train,
+        or a rebuild is running in the background).
+        The store lock is held only to take views of the rows; the index search
+        runs outside it, concurrently with other searches.
+        """
+        from app.ann import unit_rows
+
+        ann = self._ann
+        query_norms = np.linalg.norm(queries, axis=1)
+        with self.lock:
+            n = self._size
+            vectors, norms = self._vectors[:n], self._norms[:n]
+            template_ids, user_ids = self._template_ids[:n], self._user_ids[:n]
+        if not ann.sync(vectors, norms, template_ids, snapshot=self._rows):
+            return None
+        # Ids added to the index after our views were taken fail the check below
+        _, candidates = ann.search(unit_rows(queries, query_norms), min(k * ann.candidates, n))
+
+        rows = np.searchsorted(template_ids, candidates).clip(max=n - 1)
+        valid = (candidates >= 0) & (template_ids[rows] == candidates)  # drops ids removed since indexing
+        dots = np.einsum("bd,bcd->bc", queries, vectors[rows])
+        denom = query_norms[:, None] * norms[rows]
+        scores = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        scores[~valid] = -np.inf
+
+        results = []
+        for row_scores, row_users in zip(scores, user_ids[rows]):
+            order = np.argsort(-row_scores, kind="stable")
+            order = order[np.isfinite(row_scores[order])]
+            # First occurrence of each user in score order is its max template score
+            _, first = np.unique(row_users[order], return_index=True)
+            best = order[np.sort(first)[:k]]
+            results.append([(int(uid), float(score)) for uid, score in zip(row_users[best], row_scores[best])])
+        return results
+
     def add_and_generate_key(self, embedding, password: str, user_id: int):
         """
         Add embedding to JSON and generate AES-256 key
@@ -71,70 +453,221 @@ class FaissStore:
         return key
 
     def count(self) -> int:
-        """Return total stored embeddings."""
-        return len(self.data)
+        """Return total stored templates."""
+        return self._size
+
+    def user_count(self) -> int:
+        """Return number of distinct enrolled users."""
+        return len(self.user_ids())
+
+    def stats(self) -> dict:
+        """Size and search load of this gallery."""
+        return {
+            "templates": self._size,
+            "users": self.user_count(),
+            "embedding_version": self.embedding_version,
+            "queries": self.searched,
+            "avg_search_ms_per_query": round(1000 * self.search_seconds / self.searched, 4) if self.searched else 0.0,
+            "index": self._ann.config["kind"] if self._ann is not None else "exact",
+        }
+
+    def user_ids(self) -> list[int]:
+        """Return the sorted ids of all users with at least one template."""
+        return np.unique(self._user_ids[:self._size]).tolist()
+
+    def templates_for_user(self, user_id: int) -> list[int]:
+        """Return the template ids owned by a user."""
+        mask = self._user_ids[:self._size] == user_id
+        return self._template_ids[:self._size][mask].tolist()
 
     def get_all_embeddings(self):
-        """Return list of (user_id, embedding)."""
-        return [(int(uid), emb) for uid, emb in self.data.items()]
+        """Return list of (user_id, embedding), one entry per template."""
+        return [(int(uid), emb.tolist()) for uid, emb in zip(self._user_ids[:self._size], self._vectors[:self._size])]
+
+    def _snapshot(self):
+        """Consistent views of the gallery arrays plus the cached per-user grouping."""
+        with self.lock:
+            n = self._size
+            if self._grouping is None:
+                self._grouping = group_by_user(self._user_ids[:n])
+            return self._vectors[:n], self._norms[:n], self._grouping
+
+    def _user_scores(self, queries: np.ndarray, reduce: str = SCORE_REDUCE):
+        """
+        Cosine-score a (B, dim) block of queries against every template with one
+        matrix product, then reduce per user. Returns ((B, n_users) scores, user ids),
+        or None when the gallery is empty.
+        """
+        vectors, norms, grouping = self._snapshot()
+        if vectors.shape[0] == 0:
+            return None
 
-    def search_similar(self, query_embedding, k: int = 1):
+        query_norms = np.linalg.norm(queries, axis=1)
+        denom = query_norms[:, None] * norms[None, :]
+        dots = queries @ vectors.T
+        scores = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        return reduce_by_user(scores, grouping, reduce), grouping[3]
+
+    def search_similar(self, query_embedding, k: int = 1, reduce: str = SCORE_REDUCE):
         """
-        Search for the most similar embedding(s) to the query.
-        Returns list of (user_id, similarity_score) tuples, sorted by similarity (highest first).
+        Search for the most similar user(s) to the query.
+        Every template is scored by cosine similarity, then scores are reduced
+        per user (best or mean template). Returns list of (user_id, similarity_score)
+        tuples, sorted by similarity (highest first).
         """
-        if not self.data:
-            return []
-        
         query_vec = np.asarray(query_embedding, dtype=np.float32).flatten()
         if len(query_vec) != self.dim:
             raise ValueError(f"Query embedding dimension mismatch: expected {self.dim}, got {len(query_vec)}")
-        
-        similarities = []
-        for user_id_str, stored_embedding in self.data.items():
-            stored_vec = np.array(stored_embedding, dtype=np.float32)
-            
-            # Calculate cosine similarity
-            dot_product = np.dot(query_vec, stored_vec)
-            norm_query = np.linalg.norm(query_vec)
-            norm_stored = np.linalg.norm(stored_vec)
-            
-            if norm_query == 0 or norm_stored == 0:
-                similarity = 0.0
-            else:
-                similarity = dot_product / (norm_query * norm_stored)
-            
-            similarities.append((int(user_id_str), float(similarity)))
-        
-        # Sort by similarity (highest first) and return top k
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:k]
+        return self.search_similar_batch(query_vec.reshape(1, -1), k, reduce)[0]
+
+    def search_similar_batch(self, query_embeddings, k: int = 1, reduce: str = SCORE_REDUCE):
+        """
+        search_similar for a (B, dim) block of queries: one matrix product over the
+        gallery, one segment reduction and one top-k selection for all rows.
+        Returns one result list per query.
+        """
+        queries = self._as_matrix(query_embeddings)
+        started = time.perf_counter()
+        if self._ann is not None and reduce == "max":
+            results = self._ann_search(queries, k)
+            if results is not None:
+                self.searched += queries.shape[0]
+                self.search_seconds += time.perf_counter() - started
+                return results
+        result = self._user_scores(queries, reduce)
+        if result is None:
+            return [[] for _ in range(queries.shape[0])]
+        user_scores, group_user_ids = result
+
+        # Top k users per row, highest first
+        k = min(k, user_scores.shape[1])
+        top = np.argpartition(-user_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(user_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        self.searched += queries.shape[0]
+        self.search_seconds += time.perf_counter() - started
+        return [
+            [(int(uid), float(score)) for uid, score in zip(group_user_ids[row_top], row_scores)]
+            for row_top, row_scores in zip(top, top_scores)
+        ]
+
+    def score_user(self, query_embedding, user_id: int, reduce: str = SCORE_REDUCE):
+        """Similarity of a query to one user's templates (1:1 verification); None if not enrolled."""
+        query_vec = np.asarray(query_embedding, dtype=np.float32).flatten()
+        if len(query_vec) != self.dim:
+            raise ValueError(f"Query embedding dimension mismatch: expected {self.dim}, got {len(query_vec)}")
+        with self.lock:
+            mask = self._user_ids[:self._size] == user_id
+            vectors = self._vectors[:self._size][mask]
+            norms = self._norms[:self._size][mask]
+        if vectors.shape[0] == 0:
+            return None
+
+        denom = norms * np.linalg.norm(query_vec)
+        dots = vectors @ query_vec
+        scores = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        return float(scores.max() if reduce == "max" else scores.mean())
+
+    def find_duplicates(self, embeddings, threshold: float = DUPLICATE_THRESHOLD):
+        """
+        Nearest-neighbour check of each embedding against the gallery.
+        Returns one entry per row: (user_id, similarity_score) of the closest
+        enrolled user when the score reaches the threshold, else None.
+        """
+        queries = self._as_matrix(embeddings)
+        result = self._user_scores(queries, "max")
+        if result is None:
+            return [None] * queries.shape[0]
+        user_scores, group_user_ids = result
+        best = user_scores.argmax(axis=1)
+        best_scores = user_scores[np.arange(queries.shape[0]), best]
+        return [
+            (int(group_user_ids[b]), float(score)) if score >= threshold else None
+            for b, score in zip(best, best_scores)
+        ]
 
     # ------------------------------------------------
     # Persistence helpers
     # ------------------------------------------------
     def _load_json(self):
-        """Load existing embeddings safely, even if file is empty/corrupt."""
-        if os.path.exists(JSON_PATH):
+        """
+        Load existing templates safely, even if file is empty/corrupt.
+        Legacy files ({user_id: embedding}) become one template per user.
+        """
+        empty = {"templates": [], "next_template_id": 1, "embedding_version": None, "legacy": False}
+        if os.path.exists(self.json_path):
             try:
-                with open(JSON_PATH, "r") as f:
+                with open(self.json_path, "r") as f:
                     content = f.read().strip()
                     if not content:
                         print("Empty JSON file detected — resetting store.")
-                        return {}
-                    return json.loads(content)
+                        return empty
+                    raw = json.loads(content)
             except json.JSONDecodeError:
                 print("Invalid JSON detected — resetting store.")
-                return {}
-        return {}
+                return empty
 
-    def _save_json(self):
+            if "templates" in raw:
+                return {
+                    "templates": raw["templates"],
+                    "next_template_id": raw.get("next_template_id", 1),
+                    "embedding_version": raw.get("embedding_version", LEGACY_EMBEDDING_VERSION),
+                    "legacy": False,
+                }
+            templates = [
+                {"template_id": i, "user_id": int(uid), "embedding": vec}
+                for i, (uid, vec) in enumerate(raw.items(), start=1)
+            ]
+            return {"templates": templates, "next_template_id": len(templates) + 1,
+                    "embedding_version": LEGACY_EMBEDDING_VERSION, "legacy": True}
+        return empty
+
+    def write_snapshot(self) -> str:
+        """
+        Write all templates to a temporary file next to json_path and return its path.
+        Only taking views of the arrays needs the lock: rows below the current size
+        are never modified in place (appends write past them, removals make new arrays).
+        """
+        with self.lock:
+            n = self._size
+            template_ids, user_ids = self._template_ids[:n], self._user_ids[:n]
+            vectors, sources = self._vectors[:n], self._sources[:n]
+            payload = {
+                "version": STORE_FORMAT_VERSION,
+                "embedding_version": self.embedding_version,
+                "next_template_id": self._next_template_id,
+            }
+        print(f"DEBUG: Saving {n} templates to {self.json_path}")
+        payload["templates"] = [
+            {"template_id": int(tid), "user_id": int(uid), "embedding": vec, "source": src}
+            for tid, uid, vec, src in zip(template_ids, user_ids, vectors.tolist(), sources)
+        ]
+        directory, name = os.path.split(self.json_path)
+        fd, tmp = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory or ".")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(payload, f, indent=4)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return tmp
+
+    def save(self):
+        """
+        Persist all templates: the JSON is written to a temp file without holding
+        the lock (searches and writes go on), then renamed over json_path under it.
+        Saves are serialized, so the file always ends at the latest state.
+        """
         try:
-            print(f"DEBUG: Saving to {JSON_PATH}")
-            print(f"DEBUG: Data contains {len(self.data)} entries")
-            with open(JSON_PATH, "w") as f:
-                json.dump(self.data, f, indent=4)
-            print(f"DEBUG: Successfully saved to {JSON_PATH}")
+            with self._save_lock:
+                tmp = self.write_snapshot()
+                with self.lock:
+                    if self._successor is not None:
+                        os.remove(tmp)  # retired: the successor owns the file now
+                        return
+                    os.replace(tmp, self.json_path)
         except Exception as e:
-            print(f"ERROR in _save_json: {str(e)}")
+            print(f"ERROR in FaissStore.save: {str(e)}")
             raise
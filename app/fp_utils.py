@@ -6,44 +6,105 @@ import hashlib
 # -----------------------------
 # 1️⃣ Function: image → embedding vector
 # -----------------------------
-def get_fingerprint_embedding(image_path: str) -> np.ndarray:
+def get_fingerprint_embedding(image_path) -> np.ndarray:
     """
     Reads a fingerprint image (.bmp, .png, etc.) and returns a normalized embedding vector.
     This version uses pure OpenCV and NumPy — no torchvision.
+
+    Pipeline: resize to 224x224 → equalize histogram → 32x32 intensity grid
+    + 32x32 Sobel gradient-magnitude grid → L2-normalize the 2048 features →
+    keep the first 128. Shares its implementation with get_fingerprint_embeddings.
     """
+    return get_fingerprint_embeddings([image_path])[0]
 
 
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise ValueError(f"Cannot read image: {image_path}")
-
-    # Resize to fixed size for consistency
-    img = cv2.resize(img, (224, 224))
+# -----------------------------
+# 1️⃣b Function: batch of images → embedding matrix
+# -----------------------------
+EMBED_SIZE = 224  # working resolution
+FEATURE_GRID = 32  # patch / gradient grids are 32x32 → 2 x 1024 raw features
+EMBED_DIM = 128  # only the first 128 normalized features are kept
 
-    # Normalize pixel intensities
-    img = img.astype(np.float32) / 255.0
+# cv2.resize(x, (32, 32)) on a 224x224 float image samples exact pixels
+# (scale 7, zero interpolation weight), so the grids are plain strided views.
+_GRID = np.s_[3::7, 3::7]
+# uint8 → float32 / 255 as a lookup table. The old (x / 255 * 255).astype(uint8)
+# round trip before equalizeHist was an exact identity, so it is skipped.
+_TO_FLOAT = np.arange(256, dtype=np.float32) / 255.0
 
-    # Optional image enhancement (sharpening / contrast)
-    img = cv2.equalizeHist((img * 255).astype(np.uint8)).astype(np.float32) / 255.0
 
-    # Simple handcrafted embedding — compute various statistics + features
-    # 1. Flatten part of image
-    patch = cv2.resize(img, (32, 32)).flatten()
+def load_fingerprint_image(image_path: str) -> np.ndarray:
+    """Read a fingerprint image as a grayscale uint8 array."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError(f"Cannot read image: {image_path}")
+    return img
 
-    # 2. Compute gradients (texture features)
-    gx = cv2.Sobel(img, cv2.CV_32F, 1, 0, ksize=3)
-    gy = cv2.Sobel(img, cv2.CV_32F, 0, 1, ksize=3)
-    mag = cv2.magnitude(gx, gy)
-    grad_features = cv2.resize(mag, (32, 32)).flatten()
 
-    # 3. Combine + normalize
-    combined = np.concatenate([patch, grad_features])
-    embedding = combined / np.linalg.norm(combined)
+def get_fingerprint_embeddings(images) -> np.ndarray:
+    """
+    Batch version of get_fingerprint_embedding.
+    - images: sequence of image paths and/or grayscale uint8 arrays (any size)
+    Returns a (len(images), 128) float32 matrix; row i is bit-identical to
+    get_fingerprint_embedding(images[i]).
+
+    Only the first 128 intensity features survive into the embedding, but the
+    L2 norm spans all 2048 features, so gradient magnitudes are still computed;
+    the 32x32 grids are strided views instead of resizes, and the whole batch
+    is normalized in one operation.
+    """
+    n = len(images)
+    resized = np.empty((n, EMBED_SIZE, EMBED_SIZE), dtype=np.uint8)
+    equalized = np.empty_like(resized)
+    features = np.empty((n, 2, FEATURE_GRID, FEATURE_GRID), dtype=np.float32)
+    x = np.empty((EMBED_SIZE, EMBED_SIZE), dtype=np.float32)
+    gx = np.empty_like(x)
+    gy = np.empty_like(x)
+    mag = np.empty_like(x)
+
+    for i, image in enumerate(images):
+        img = load_fingerprint_image(image) if isinstance(image, str) else image
+        cv2.resize(img, (EMBED_SIZE, EMBED_SIZE), dst=resized[i])
+        cv2.equalizeHist(resized[i], dst=equalized[i])
+
+        np.take(_TO_FLOAT, equalized[i], out=x)
+        features[i, 0] = x[_GRID]
+        cv2.Sobel(x, cv2.CV_32F, 1, 0, dst=gx, ksize=3)
+        cv2.Sobel(x, cv2.CV_32F, 0, 1, dst=gy, ksize=3)
+        cv2.magnitude(gx, gy, magnitude=mag)
+        features[i, 1] = mag[_GRID]
+
+    # Whole-batch normalization. A stacked (1 x 2048) @ (2048 x 1) matmul runs the
+    # same BLAS dot per row as np.linalg.norm on a single vector.
+    combined = features.reshape(n, 2 * FEATURE_GRID * FEATURE_GRID)
+    norms = np.sqrt(np.matmul(combined[:, None, :], combined[:, :, None])[:, 0, 0])
+    return combined[:, :EMBED_DIM] / norms[:, None]
 
-    if embedding.shape[0] != 128:
-        embedding = np.resize(embedding, 128)
 
-    return embedding.astype(np.float32)
+# -----------------------------
+# 1️⃣c Embedding algorithm versions
+# -----------------------------
+# Bump EMBEDDING_VERSION whenever feature extraction changes, and register the
+# new extractor here. Keep old extractors registered while any user's AES key
+# still derives from them (users.key_version); see app/migration.py.
+EMBEDDING_VERSION = 1
+EXTRACTORS = {
+    1: get_fingerprint_embeddings,
+}
+
+
+def embed_images(images, version: int = EMBEDDING_VERSION) -> np.ndarray:
+    """get_fingerprint_embeddings with the extractor of a given embedding version."""
+    try:
+        extractor = EXTRACTORS[version]
+    except KeyError:
+        raise ValueError(f"Unknown embedding version: {version}")
+    return extractor(images)
+
+
+def init_worker():
+    """Initializer for process pools that embed images (app/enroll.py, app/migration.py)."""
+    cv2.setNumThreads(1)  # parallelism comes from the pool, not from OpenCV
 
 
 # -----------------------------
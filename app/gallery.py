@@ -0,0 +1,218 @@
+# app/gallery.py
+import os
+import re
+import glob
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Default tenant's gallery stays at FAISS_JSON_PATH; other tenants get GALLERY_DIR/<tenant>.json
+GALLERY_DIR = os.getenv("GALLERY_DIR", "./data/galleries")
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# A failed warm-up (e.g. DB unreachable at boot) is retried with exponential backoff
+GALLERY_WARMUP_RETRIES = int(os.getenv("GALLERY_WARMUP_RETRIES", "5"))
+GALLERY_WARMUP_BACKOFF_SECONDS = float(os.getenv("GALLERY_WARMUP_BACKOFF_SECONDS", "1"))
+GALLERY_WARMUP_MAX_BACKOFF_SECONDS = 30.0
+
+
+class GalleryPartition:
+    """One tenant's gallery: its own store (index + JSON file) and stats."""
+
+    def __init__(self, tenant: str, store):
+        self.tenant = tenant
+        self.store = store  # swapped atomically by a migration (app/migration.py)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+class GalleryLoader:
+    """
+    Background warm-up of the embedding galleries, one partition per tenant.
+    - Creates the DB schema and loads persisted embeddings off the request path
+    - Drops embeddings whose user no longer exists in the database (or moved tenant)
+    - Tracks progress so /healthz and /readyz can report it
+    - Retries a failed warm-up up to `retries` times with exponential backoff;
+      after that the status stays "failed" and /healthz reports 503
+    - New tenants get an empty partition on their first registration
+    - Each store uses the tenant's tuned ANN index, if any (app/ann_tune.py)
+    - The same user stream pre-warms the encrypted user row cache, if given
+    """
+
+    def __init__(self, session_factory, init_schema=None, store_factory=None, gallery_dir: str = GALLERY_DIR,
+                 ann_config_path: str | None = None, user_cache=None, retries: int = GALLERY_WARMUP_RETRIES,
+                 backoff: float = GALLERY_WARMUP_BACKOFF_SECONDS):
+        from app.models import DEFAULT_TENANT
+
+        self.session_factory = session_factory
+        self.init_schema = init_schema
+        self.store_factory = store_factory
+        self.gallery_dir = gallery_dir
+        self.ann_config_path = ann_config_path  # default: ANN_CONFIG_PATH
+        self.user_cache = user_cache  # app/user_cache.py UserRowCache
+        self.retries = retries
+        self.backoff = backoff
+        self.attempts = 0
+        self.default_tenant = DEFAULT_TENANT
+        self.partitions = {}
+        self.status = "pending"
+        self.loaded = 0
+        self.total = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def store(self):
+        """The default tenant's store."""
+        partition = self.partitions.get(self.default_tenant)
+        return partition.store if partition is not None else None
+
+    def start(self):
+        """Start warm-up in a daemon thread; returns immediately."""
+        self.status = "loading"
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run_with_retries, name="gallery-warmup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until warm-up finishes (used by tests and CLI tools)."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    def _run_with_retries(self):
+        delay = self.backoff
+        while True:
+            self.run()
+            if self.ready or self.attempts > self.retries:
+                return
+            print(f"Retrying gallery warm-up in {delay:.1f}s (attempt {self.attempts + 1} of {self.retries + 1})")
+            self.status = "loading"
+            time.sleep(delay)
+            delay = min(delay * 2, GALLERY_WARMUP_MAX_BACKOFF_SECONDS)
+
+    def run(self):
+        """One warm-up attempt; status ends "ready" or "failed"."""
+        self.attempts += 1
+        self.finished_at = None
+        self._progress = {}
+        try:
+            if self.init_schema is not None:
+                self.init_schema()
+
+            # Heavy imports (numpy / cv2) happen here, not at app import time
+            from app.fp_utils import EMBEDDING_VERSION  # (also pre-warms cv2 for the first request)
+
+            users = self._db_user_ids()
+            tenants = {self.default_tenant} | set(self._persisted_tenants())
+            partitions = {}
+            for tenant in sorted(tenants):
+                store = self._new_store(tenant)
+                store.load(keep_user_ids=users.get(tenant, set()), progress=self._on_progress(tenant))
+                store.build_ann()  # before ready, so no query pays for it
+                if store.embedding_version != EMBEDDING_VERSION:
+                    print(f"WARNING: gallery '{tenant}' is embedding v{store.embedding_version}, extractor is "
+                          f"v{EMBEDDING_VERSION}; start a migration (POST /admin/migrations?target_version={EMBEDDING_VERSION})")
+                partitions[tenant] = GalleryPartition(tenant, store)
+
+            self.partitions = partitions
+            self.error = None
+            self.status = "ready"
+        except Exception as e:
+            print(f"ERROR in gallery warm-up: {str(e)}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+
+    def partition(self, tenant: str, create: bool = False) -> GalleryPartition | None:
+        """A tenant's partition; with create, an empty one is made for a new tenant."""
+        partition = self.partitions.get(tenant)
+        if partition is None and create:
+            with self._lock:
+                partition = self.partitions.get(tenant)
+                if partition is None:
+                    partition = GalleryPartition(tenant, self._new_store(tenant))
+                    self.partitions = {**self.partitions, tenant: partition}
+                    print(f"Created gallery partition '{tenant}'")
+        return partition
+
+    def _new_store(self, tenant: str):
+        from app.ann import ANN_CONFIG_PATH, load_ann_config
+        from app.fp_utils import EMBEDDING_VERSION
+
+        if tenant == self.default_tenant and self.store_factory is not None:
+            store = self.store_factory()
+        else:
+            from app.faiss_store import FaissStore
+            if tenant == self.default_tenant:
+                store = FaissStore(load=False, embedding_version=EMBEDDING_VERSION)
+            else:
+                json_path = os.path.join(self.gallery_dir, f"{tenant}.json")
+                store = FaissStore(json_path=json_path, load=False, embedding_version=EMBEDDING_VERSION)
+        config = load_ann_config(tenant, self.ann_config_path or ANN_CONFIG_PATH)
+        if config is not None:
+            print(f"Gallery '{tenant}' searches with a {config['kind']} index {config.get('params', {})}")
+            store.enable_ann(config)
+        return store
+
+    def _persisted_tenants(self) -> list[str]:
+        names = (os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(self.gallery_dir, "*.json")))
+        return [name for name in names if TENANT_PATTERN.match(name)]
+
+    def _db_user_ids(self) -> dict[str, set[int]]:
+        """User ids per tenant. With a user row cache, the first rows of the stream also fill it."""
+        from app.models import User
+        from app.user_cache import cached_columns
+
+        db = self.session_factory()
+        try:
+            users = {}
+            last_id = None
+            if self.user_cache is not None and self.user_cache.enabled:
+                warm = db.query(*cached_columns()).order_by(User.user_id).limit(self.user_cache.max_size)
+                for row in warm.yield_per(1000):
+                    users.setdefault(row.tenant, set()).add(row.user_id)
+                    self.user_cache.prewarm(row)
+                    last_id = row.user_id
+            # Ids only for the users past what the cache can hold
+            rest = db.query(User.tenant, User.user_id)
+            if last_id is not None:
+                rest = rest.filter(User.user_id > last_id)
+            for tenant, user_id in rest.yield_per(1000):
+                users.setdefault(tenant, set()).add(user_id)
+            return users
+        finally:
+            db.close()
+
+    def _on_progress(self, tenant: str):
+        def progress(loaded: int, total: int):
+            self._progress[tenant] = (loaded, total)
+            self.loaded = sum(done for done, _ in self._progress.values())
+            self.total = sum(count for _, count in self._progress.values())
+        return progress
+
+    def info(self) -> dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "status": self.status,
+            "loaded": self.loaded,
+            "total": self.total,
+            "elapsed_seconds": elapsed,
+            "embedding_version": self.store.embedding_version if self.store is not None else None,
+            "partitions": sorted(self.partitions),
+            "attempts": self.attempts,
+            "error": self.error,
+        }
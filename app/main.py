@@ -1,182 +1,609 @@
-from fastapi import FastAPI, HTTPException, Depends
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Header, Query
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from app.db import SessionLocal, init_db
-from app.models import Base, User
-from app.schemas import UserRegistrationRequest, UserRegistrationResponse, UserDecryptionRequest, UserDecryptionResponse
-from app.fp_utils import get_fingerprint_embedding
-from app.key_utils import generate_key_from_embedding
-from app.encryption import encrypt_data, decrypt_data
-from app.faiss_store import FaissStore
-import os
+from app.models import Base, User, DEFAULT_TENANT
+from app.schemas import (
+    UserRegistrationRequest, UserRegistrationResponse, UserDecryptionRequest, UserDecryptionResponse,
+    BulkRegistrationRequest, BulkRegistrationResult, BulkRegistrationResponse,
+    EmbeddingMatch, EmbeddingIdentifyResponse,
+)
+from app.encryption import decrypt_data
+from app.users import encrypted_fields, build_user_record
+from app.gallery import GalleryLoader, GALLERY_DIR, TENANT_PATTERN
+from app.admission import (ADMISSION_DEFAULT_TIMEOUT, AdmissionRejected, Deadline, DeadlineExceeded,
+                           build_controllers, deadline_from_headers)
+from app.quality import QualityError, QualityGate
+from app.sources import SourceImageStore
+from app.batching import SearchCoalescer
+from app.user_cache import UserRowCache
 
-app = FastAPI()
+# NOTE: app.fp_utils (cv2 + numpy), app.key_utils and app.faiss_store are imported
+# lazily inside the handlers / warm-up thread so importing this module stays cheap.
 
-# Initialize database
-init_db(Base)
+router = APIRouter()
 
-# Initialize FaissStore
-faiss_store = FaissStore()
+# Endpoints whose 1:N searches go through the search coalescer
+SEARCH_ENDPOINTS = ("decrypt", "identify", "verify")
 
-# Clear old data and sync with database
-print("DEBUG: Clearing old FaissStore data...")
-faiss_store.reset_index()
-print("DEBUG: FaissStore cleared")
-
-def get_db():
-    db = SessionLocal()
+def get_db(request: Request):
+    db = request.app.state.session_factory()
     try:
         yield db
     finally:
         db.close()
 
-@app.post("/register", response_model=UserRegistrationResponse)
-async def register_user(user_data: UserRegistrationRequest, db: Session = Depends(get_db)):
+def get_tenant(x_tenant: str = Header(DEFAULT_TENANT)) -> str:
+    """Tenant / site from the X-Tenant header; selects the gallery partition."""
+    if not TENANT_PATTERN.match(x_tenant):
+        raise HTTPException(status_code=422, detail="X-Tenant must be 1-64 letters, digits, '-' or '_'")
+    return x_tenant
+
+def tenant_partition(request: Request, tenant: str, create: bool = False):
+    """The tenant's gallery partition; 503 until warm-up has finished, 404 for unknown tenants."""
+    gallery = request.app.state.gallery
+    if not gallery.ready:
+        raise HTTPException(status_code=503, detail=f"Gallery not ready: {gallery.status}")
+    partition = gallery.partition(tenant, create=create)
+    if partition is None:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant: {tenant}")
+    return partition
+
+def get_partition(request: Request, tenant: str = Depends(get_tenant)):
+    return tenant_partition(request, tenant)
+
+def get_store(request: Request, tenant: str = Depends(get_tenant)):
+    """Gallery dependency: the tenant's store; 503 until the background warm-up has finished."""
+    return tenant_partition(request, tenant).store
+
+def get_or_create_store(request: Request, tenant: str = Depends(get_tenant)):
+    """get_store for registrations: a new tenant gets an empty partition."""
+    return tenant_partition(request, tenant, create=True).store
+
+def admit(endpoint: str):
+    """
+    Dependency: hold an admission slot for `endpoint` while the request runs.
+    Saturation is answered right away with 503 + Retry-After instead of queueing
+    without bound behind the embedding step and the DB pool. The client's
+    deadline is kept on request.state for the handler (see get_deadline).
+    """
+    async def dependency(request: Request):
+        controller = request.app.state.admission[endpoint]
+        deadline = request.state.deadline = deadline_from_headers(request.headers)
+        remaining = deadline.remaining()
+        try:
+            async with controller.slot(ADMISSION_DEFAULT_TIMEOUT if remaining is None else remaining):
+                yield
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return dependency
+
+def get_deadline(request: Request) -> Deadline:
+    return getattr(request.state, "deadline", None) or Deadline()
+
+def check_deadline(deadline: Deadline | None, stage: str):
+    """504 once the client's budget is spent; handlers call this between stages."""
+    if deadline is None:
+        return
     try:
-        # 1. Get fingerprint embedding
-        embedding = get_fingerprint_embedding(user_data.fingerprint_image_path)
-        
-        # 2. Generate AES key from embedding + password
-        aes_key = generate_key_from_embedding(embedding, user_data.password)
-        
-        # 3. Encrypt name and age
-        enc_name, name_nonce, name_tag = encrypt_data(user_data.name, aes_key)
-        enc_age, age_nonce, age_tag = encrypt_data(str(user_data.age), aes_key)
-        
-        # 4. Create user record
-        user = User(
-            enc_name=enc_name,
-            enc_age=enc_age,
-            name_nonce=name_nonce,
-            name_tag=name_tag,
-            age_nonce=age_nonce,
-            age_tag=age_tag,
-            status="active"
-        )
-        
+        deadline.check(stage)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+def get_quality(request: Request) -> QualityGate:
+    return request.app.state.quality
+
+def get_sources(request: Request) -> SourceImageStore:
+    return request.app.state.sources
+
+def get_user_cache(request: Request) -> UserRowCache:
+    return request.app.state.user_cache
+
+def get_coalescer(request: Request) -> SearchCoalescer:
+    return request.app.state.search_batching
+
+def load_checked_images(paths: list[str], quality: QualityGate) -> list:
+    """
+    Read the images and run the quality gate on each, before any embedding,
+    search or DB work. Raises QualityError for the first unusable scan.
+    """
+    from app.fp_utils import load_fingerprint_image
+
+    images = [load_fingerprint_image(path) for path in paths]
+    for image in images:
+        quality.check(image)
+    return images
+
+def quality_rejection(e: QualityError) -> HTTPException:
+    return HTTPException(status_code=422, detail=e.detail())
+
+def raise_duplicate(conflict):
+    conflicting_user_id, similarity_score = conflict
+    raise HTTPException(
+        status_code=409,
+        detail={
+            "message": "Fingerprint is already enrolled",
+            "conflicting_user_id": conflicting_user_id,
+            "similarity_score": similarity_score,
+        },
+    )
+
+def register_embeddings(name: str, age: int, password: str, embeddings, db: Session, faiss_store,
+                        source_images=None, source_store: SourceImageStore | None = None,
+                        tenant: str = DEFAULT_TENANT, deadline: Deadline | None = None) -> UserRegistrationResponse:
+    """
+    Registration once the templates are known; shared by /register and /embeddings/register.
+    source_images are retained (for re-embedding on algorithm upgrades) once accepted.
+    faiss_store is the tenant's partition; duplicates are only checked within it.
+    """
+    # From the duplicate check through the template write we hold the gallery's
+    # enrollment lock, so two concurrent enrollments of one finger can't both pass
+    with faiss_store.enroll_lock:
+        # 1. Reject fingers that are already enrolled
+        conflict = next((c for c in faiss_store.find_duplicates(embeddings) if c is not None), None)
+        if conflict is not None:
+            raise_duplicate(conflict)
+        check_deadline(deadline, "before saving the user")
+
+        # 2. Create user record (name/age encrypted with embedding + password key)
+        user = build_user_record(name, age, password, embeddings[0], faiss_store.embedding_version, tenant)
+        sources = [SourceImageStore.key_for(image) for image in source_images] if source_images is not None else None
+
         db.add(user)
         db.commit()
         db.refresh(user)
-        
-        # 5. Add embedding to FaissStore for future matching
+
+        # 3. Add templates to FaissStore for future matching; only a committed
+        #    user's scans are retained, so a failed insert leaves no images behind
         print(f"DEBUG: Adding user {user.user_id} to FaissStore...")
-        faiss_store.add(embedding, user.user_id)
-        print(f"DEBUG: FaissStore now has {faiss_store.count()} embeddings")
-        print(f"DEBUG: FaissStore user IDs: {list(faiss_store.data.keys())}")
-        
-        return UserRegistrationResponse(
-            user_id=user.user_id,
-            status="success",
-            message="User registered successfully"
-        )
+        template_ids = faiss_store.add_templates(embeddings, user.user_id, sources)
+        for image in source_images or []:
+            source_store.put(image)
+        print(f"DEBUG: FaissStore now has {faiss_store.count()} templates")
+    
+    return UserRegistrationResponse(
+        user_id=user.user_id,
+        status="success",
+        message="User registered successfully",
+        template_ids=template_ids
+    )
+
+@router.post("/register", response_model=UserRegistrationResponse, dependencies=[Depends(admit("register"))])
+def register_user(user_data: UserRegistrationRequest, db: Session = Depends(get_db), faiss_store=Depends(get_or_create_store),
+                  quality: QualityGate = Depends(get_quality), sources: SourceImageStore = Depends(get_sources),
+                  tenant: str = Depends(get_tenant), deadline: Deadline = Depends(get_deadline)):
+    from app.fp_utils import embed_images
+
+    try:
+        images = load_checked_images(user_data.image_paths, quality)
+        check_deadline(deadline, "after loading images")
+        started = time.perf_counter()
+        # Get fingerprint embeddings (one template per image, with the gallery's algorithm version)
+        embeddings = embed_images(images, faiss_store.embedding_version)
+        response = register_embeddings(user_data.name, user_data.age, user_data.password, embeddings, db, faiss_store,
+                                       source_images=images, source_store=sources, tenant=tenant, deadline=deadline)
+        quality.record_pipeline(time.perf_counter() - started)
+        return response
         
+    except QualityError as e:
+        raise quality_rejection(e)
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/decrypt", response_model=UserDecryptionResponse)
-async def decrypt_user_data(request_data: UserDecryptionRequest, db: Session = Depends(get_db)):
-    try:
-        # 1. Get fingerprint embedding from the provided image
-        query_embedding = get_fingerprint_embedding(request_data.fingerprint_image_path)
-        
-        # 2. Search for the most similar embedding in FaissStore
+@router.post("/register/bulk", response_model=BulkRegistrationResponse, dependencies=[Depends(admit("register_bulk"))])
+def register_users_bulk(bulk_data: BulkRegistrationRequest, db: Session = Depends(get_db),
+                        faiss_store=Depends(get_or_create_store), quality: QualityGate = Depends(get_quality),
+                        sources: SourceImageStore = Depends(get_sources), tenant: str = Depends(get_tenant),
+                        deadline: Deadline = Depends(get_deadline)):
+    """
+    Register many users in one transaction.
+    Low-quality scans are rejected per entry before embedding. Duplicates are
+    rejected per entry: against the existing gallery, and within the batch
+    itself (the first occurrence wins) using one similarity matrix.
+    """
+    import numpy as np
+    from app.fp_utils import embed_images
+    from app.faiss_store import duplicates_within_batch
+
+    results = [None] * len(bulk_data.users)
+
+    # 1. Read and quality-check every image; bad entries are reported, not fatal
+    images, groups, loaded = [], [], []
+    for index, user_data in enumerate(bulk_data.users):
+        try:
+            entry_images = load_checked_images(user_data.image_paths, quality)
+        except QualityError as e:
+            results[index] = BulkRegistrationResult(index=index, status="rejected", message=str(e), code=e.code)
+            continue
+        except Exception as e:
+            results[index] = BulkRegistrationResult(index=index, status="error", message=str(e))
+            continue
+        groups.extend([len(loaded)] * len(entry_images))
+        images.extend(entry_images)
+        loaded.append((index, user_data, entry_images))
+
+    check_deadline(deadline, "after loading images")
+    if loaded:
+        started = time.perf_counter()
+        # 2. Embed all images in one batch
+        rows = embed_images(images, faiss_store.embedding_version)
+        groups = np.asarray(groups)
+        per_entry = np.split(rows, np.cumsum([len(entry_images) for _, _, entry_images in loaded])[:-1])
+        entries = [(index, user_data, embs) for (index, user_data, _), embs in zip(loaded, per_entry)]
+
+        # 3.-5. under the gallery's enrollment lock: concurrent registrations
+        # (/register, /embeddings/register, other bulk requests) can't slip a duplicate in
+        with faiss_store.enroll_lock:
+            # 3. Duplicates against the gallery (one matrix product for all rows)
+            gallery_hits = {}
+            for group, hit in zip(groups.tolist(), faiss_store.find_duplicates(rows)):
+                if hit is not None:
+                    gallery_hits.setdefault(group, hit)
+            # 4. Duplicates within the batch (one similarity matrix)
+            batch_hits = duplicates_within_batch(rows, groups, rejected=gallery_hits.keys())
+
+            loaded_images = {index: entry_images for index, _, entry_images in loaded}
+            accepted = []
+            for group, (index, user_data, embeddings) in enumerate(entries):
+                conflict = gallery_hits.get(group)
+                if conflict is not None:
+                    results[index] = BulkRegistrationResult(
+                        index=index, status="duplicate", message="Fingerprint is already enrolled",
+                        conflicting_user_id=conflict[0], similarity_score=conflict[1])
+                elif batch_hits[group] is not None:
+                    earlier_group, score = batch_hits[group]
+                    results[index] = BulkRegistrationResult(
+                        index=index, status="duplicate", message="Fingerprint duplicates an earlier entry in this batch",
+                        duplicate_of_index=entries[earlier_group][0], similarity_score=score)
+                else:
+                    accepted.append((index, user_data, embeddings))
+
+            # 5. Insert accepted users in one transaction, then their templates in one write
+            check_deadline(deadline, "before saving users")
+            if accepted:
+                try:
+                    version = faiss_store.embedding_version
+                    users = [build_user_record(u.name, u.age, u.password, embs[0], version, tenant) for _, u, embs in accepted]
+                    accepted_images = [image for index, _, _ in accepted for image in loaded_images[index]]
+                    db.add_all(users)
+                    db.flush()  # assigns ids; read them now, commit expires (and would reload) every row
+                    user_ids = [user.user_id for user in users]
+                    db.commit()
+                    owners = [user_id for user_id, (_, _, embs) in zip(user_ids, accepted) for _ in embs]
+                    template_ids = faiss_store.add_batch(np.concatenate([embs for _, _, embs in accepted]), owners,
+                                                         [SourceImageStore.key_for(image) for image in accepted_images])
+                    for image in accepted_images:  # only committed users' scans are retained
+                        sources.put(image)
+                except Exception as e:
+                    db.rollback()
+                    raise HTTPException(status_code=400, detail=str(e))
+
+                offset = 0
+                for user_id, (index, _, embs) in zip(user_ids, accepted):
+                    results[index] = BulkRegistrationResult(
+                        index=index, status="success", message="User registered successfully",
+                        user_id=user_id, template_ids=template_ids[offset:offset + len(embs)])
+                    offset += len(embs)
+
+        quality.record_pipeline(time.perf_counter() - started, count=len(loaded))
+
+    return BulkRegistrationResponse(
+        registered=sum(r.status == "success" for r in results),
+        results=results
+    )
+
+def decrypt_with_embedding(query_embedding, password: str, db: Session, faiss_store, user_id: int | None = None,
+                           image=None, coalescer: SearchCoalescer | None = None,
+                           user_cache: UserRowCache | None = None,
+                           deadline: Deadline | None = None) -> UserDecryptionResponse:
+    """
+    Match a query embedding, re-derive the AES key from it and decrypt the user's data.
+    Shared by /decrypt and /embeddings/verify; user_id restricts matching to one user.
+    With the query image, users whose key predates the gallery's embedding version
+    are decrypted with their old extractor and then re-keyed to the current one.
+    With a coalescer, the 1:N search is batched with concurrent requests; with a
+    user_cache, the matched user's encrypted row usually comes from memory.
+    """
+    from app.key_utils import generate_key_from_embedding
+    from app.fp_utils import embed_images
+
+    # 1. Search for the most similar embedding in FaissStore
+    #    (or score only the claimed user's templates for 1:1 verification)
+    if user_id is None and coalescer is not None:
+        similar_users = coalescer.search_from_thread(faiss_store, query_embedding, k=1)[0]
+    elif user_id is None:
         similar_users = faiss_store.search_similar(query_embedding, k=1)
-        
-        if not similar_users:
-            # Debug: Check what's in FaissStore
-            all_users = db.query(User).all()
-            db_user_ids = [u.user_id for u in all_users]
-            faiss_user_ids = list(faiss_store.data.keys())
-            
-            debug_info = {
-                "database_user_ids": db_user_ids,
-                "faiss_user_ids": faiss_user_ids,
-                "faiss_count": faiss_store.count(),
-                "db_count": len(db_user_ids)
-            }
-            
-            raise HTTPException(
-                status_code=404, 
-                detail=f"No matching fingerprint found. Debug info: {debug_info}"
-            )
-        
-        # Get the highest match
-        matched_user_id, similarity_score = similar_users[0]
-        
-        # 3. Retrieve user data from PostgreSQL
+    else:
+        score = faiss_store.score_user(query_embedding, user_id)
+        similar_users = [] if score is None else [(user_id, score)]
+    check_deadline(deadline, "after search")
+    
+    if not similar_users:
+        # No id dumps here: they would cost O(users) per miss and expose other
+        # tenants' users; GET /debug lists the requested tenant's ids instead
+        print(f"DEBUG: No match among {faiss_store.count()} templates")
+        raise HTTPException(status_code=404, detail="No matching fingerprint found")
+    
+    # Get the highest match
+    matched_user_id, similarity_score = similar_users[0]
+    
+    # 2. Retrieve the user's encrypted row (cached, else from PostgreSQL)
+    if user_cache is not None:
+        user = user_cache.get(db, matched_user_id)
+    else:
         user = db.query(User).filter(User.user_id == matched_user_id).first()
-        if not user:
-            # Debug: Check what users exist in database vs FaissStore
-            all_users = db.query(User).all()
-            db_user_ids = [u.user_id for u in all_users]
-            faiss_user_ids = list(faiss_store.data.keys())
-            
-            debug_info = {
-                "database_user_ids": db_user_ids,
-                "faiss_user_ids": faiss_user_ids,
-                "matched_user_id": matched_user_id,
-                "matched_user_id_type": type(matched_user_id).__name__
-            }
-            
-            raise HTTPException(
-                status_code=404, 
-                detail=f"User data not found in database. Debug info: {debug_info}"
-            )
+    if not user:
+        print(f"DEBUG: Matched user {matched_user_id} has templates but no database row")
+        raise HTTPException(status_code=404, detail="User data not found in database")
+    
+    # 3. Generate the same AES key using embedding + password
+    #    (from the extractor the user enrolled with, if the gallery was migrated since)
+    key_embedding = query_embedding
+    if image is not None and user.key_version != faiss_store.embedding_version:
+        print(f"DEBUG: User {user.user_id} key is embedding v{user.key_version}, gallery is v{faiss_store.embedding_version}")
+        key_embedding = embed_images([image], user.key_version)[0]
+    aes_key = generate_key_from_embedding(key_embedding, password)
+    
+    # 4. Decrypt the user data
+    try:
+        print(f"DEBUG: Attempting decryption with key length: {len(aes_key)}")
+        print(f"DEBUG: User data lengths - name: {len(user.enc_name)}, age: {len(user.enc_age)}")
+        print(f"DEBUG: Name nonce length: {len(user.name_nonce)}, name tag length: {len(user.name_tag)}")
+        print(f"DEBUG: Age nonce length: {len(user.age_nonce)}, age tag length: {len(user.age_tag)}")
         
-        # 4. Generate the same AES key using embedding + password
-        aes_key = generate_key_from_embedding(query_embedding, request_data.password)
+        decrypted_name = decrypt_data(user.enc_name, aes_key, user.name_nonce, user.name_tag)
+        print(f"DEBUG: Name decrypted successfully: {decrypted_name}")
         
-        # 5. Decrypt the user data
-        try:
-            print(f"DEBUG: Attempting decryption with key length: {len(aes_key)}")
-            print(f"DEBUG: User data lengths - name: {len(user.enc_name)}, age: {len(user.enc_age)}")
-            print(f"DEBUG: Name nonce length: {len(user.name_nonce)}, name tag length: {len(user.name_tag)}")
-            print(f"DEBUG: Age nonce length: {len(user.age_nonce)}, age tag length: {len(user.age_tag)}")
-            
-            decrypted_name = decrypt_data(user.enc_name, aes_key, user.name_nonce, user.name_tag)
-            print(f"DEBUG: Name decrypted successfully: {decrypted_name}")
-            
-            decrypted_age = decrypt_data(user.enc_age, aes_key, user.age_nonce, user.age_tag)
-            print(f"DEBUG: Age decrypted successfully: {decrypted_age}")
-            
-        except Exception as decrypt_error:
-            print(f"DEBUG: Decryption error: {str(decrypt_error)}")
-            print(f"DEBUG: Error type: {type(decrypt_error).__name__}")
-            import traceback
-            print(f"DEBUG: Traceback: {traceback.format_exc()}")
-            raise HTTPException(status_code=400, detail=f"Decryption failed: {str(decrypt_error)}")
+        decrypted_age = decrypt_data(user.enc_age, aes_key, user.age_nonce, user.age_tag)
+        print(f"DEBUG: Age decrypted successfully: {decrypted_age}")
         
-        return UserDecryptionResponse(
-            user_id=matched_user_id,
-            name=decrypted_name,
-            age=int(decrypted_age),
-            status="success",
-            message="User data decrypted successfully",
-            similarity_score=similarity_score
-        )
+    except Exception as decrypt_error:
+        print(f"DEBUG: Decryption error: {str(decrypt_error)}")
+        print(f"DEBUG: Error type: {type(decrypt_error).__name__}")
+        import traceback
+        print(f"DEBUG: Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=400, detail=f"Decryption failed: {str(decrypt_error)}")
+    
+    # 5. Re-key a migrated user now that we hold the password (best effort)
+    if key_embedding is not query_embedding:
+        try:
+            record = db.get(User, matched_user_id)  # `user` may be a read-only cached copy
+            for column, value in encrypted_fields(decrypted_name, decrypted_age, password, query_embedding).items():
+                setattr(record, column, value)
+            record.key_version = faiss_store.embedding_version
+            db.commit()  # also evicts the user from the row cache
+            print(f"DEBUG: User {record.user_id} re-keyed to embedding v{record.key_version}")
+        except Exception as rekey_error:
+            db.rollback()
+            print(f"ERROR re-keying user {matched_user_id}: {str(rekey_error)}")
+    
+    return UserDecryptionResponse(
+        user_id=matched_user_id,
+        name=decrypted_name,
+        age=int(decrypted_age),
+        status="success",
+        message="User data decrypted successfully",
+        similarity_score=similarity_score
+    )
+
+@router.post("/decrypt", response_model=UserDecryptionResponse, dependencies=[Depends(admit("decrypt"))])
+def decrypt_user_data(request_data: UserDecryptionRequest, db: Session = Depends(get_db), faiss_store=Depends(get_store),
+                      quality: QualityGate = Depends(get_quality), coalescer: SearchCoalescer = Depends(get_coalescer),
+                      user_cache: UserRowCache = Depends(get_user_cache), deadline: Deadline = Depends(get_deadline)):
+    from app.fp_utils import embed_images
+
+    try:
+        image, = load_checked_images([request_data.fingerprint_image_path], quality)
+        check_deadline(deadline, "after loading images")
+        started = time.perf_counter()
+        # Get fingerprint embedding from the provided image
+        query_embedding = embed_images([image], faiss_store.embedding_version)[0]
+        response = decrypt_with_embedding(query_embedding, request_data.password, db, faiss_store, image=image,
+                                          coalescer=coalescer, user_cache=user_cache, deadline=deadline)
+        quality.record_pipeline(time.perf_counter() - started)
+        return response
         
+    except QualityError as e:
+        raise quality_rejection(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def octet_stream_body(request: Request) -> bytes:
+    """Raw body of the /embeddings/* endpoints, which only accept application/octet-stream."""
+    from app.embedding_io import OCTET_STREAM
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != OCTET_STREAM:
+        raise HTTPException(status_code=415, detail=f"Expected {OCTET_STREAM} body of little-endian float32 vectors")
+    return await request.body()
+
+def parse_body_embeddings(body: bytes, max_batch: int | None = None):
+    """Zero-copy parse of an octet-stream body; malformed vectors are a 422."""
+    from app.embedding_io import EmbeddingFormatError, parse_embeddings, EMBEDDING_MAX_BATCH
+
+    try:
+        return parse_embeddings(body, max_batch=max_batch or EMBEDDING_MAX_BATCH)
+    except EmbeddingFormatError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.post("/embeddings/identify", response_model=EmbeddingIdentifyResponse, dependencies=[Depends(admit("identify"))])
+def identify_embeddings(k: int = Query(1, ge=1, le=100), body: bytes = Depends(octet_stream_body), faiss_store=Depends(get_store),
+                        coalescer: SearchCoalescer = Depends(get_coalescer), deadline: Deadline = Depends(get_deadline)):
+    """1:N search for one or more device-computed templates; no image processing, no decryption."""
+    queries = parse_body_embeddings(body)
+    results = coalescer.search_from_thread(faiss_store, queries, k=k)
+    check_deadline(deadline, "after search")
+    return EmbeddingIdentifyResponse(
+        results=[[EmbeddingMatch(user_id=uid, similarity_score=score) for uid, score in row] for row in results]
+    )
+
+@router.post("/embeddings/verify", response_model=UserDecryptionResponse, dependencies=[Depends(admit("verify"))])
+def verify_embedding(user_id: Optional[int] = None, x_password: str = Header(...), body: bytes = Depends(octet_stream_body),
+                     db: Session = Depends(get_db), faiss_store=Depends(get_store),
+                     coalescer: SearchCoalescer = Depends(get_coalescer), user_cache: UserRowCache = Depends(get_user_cache),
+                     deadline: Deadline = Depends(get_deadline)):
+    """
+    /decrypt for a device-computed template. With user_id the template is only
+    compared with that user's templates (1:1), otherwise the whole gallery.
+    """
+    query_embedding = parse_body_embeddings(body, max_batch=1)[0]
+    try:
+        return decrypt_with_embedding(query_embedding, x_password, db, faiss_store, user_id=user_id, coalescer=coalescer,
+                                      user_cache=user_cache, deadline=deadline)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/embeddings/register", response_model=UserRegistrationResponse, dependencies=[Depends(admit("register"))])
+def register_embedding(name: str, age: int, x_password: str = Header(...), body: bytes = Depends(octet_stream_body),
+                       db: Session = Depends(get_db), faiss_store=Depends(get_or_create_store),
+                       tenant: str = Depends(get_tenant), deadline: Deadline = Depends(get_deadline)):
+    """/register for device-computed templates; every vector in the body becomes a template of the new user."""
+    embeddings = parse_body_embeddings(body)
+    try:
+        return register_embeddings(name, age, x_password, embeddings, db, faiss_store, tenant=tenant, deadline=deadline)
     except HTTPException:
+        db.rollback()
         raise
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/")
+@router.post("/admin/migrations", status_code=202)
+def start_migration(request: Request, target_version: int = Query(..., ge=1), drop_missing: bool = False,
+                    partition=Depends(get_partition)):
+    """
+    Re-embed the tenant's gallery with another embedding algorithm version in the
+    background; search keeps running and the new gallery is swapped in atomically.
+    """
+    from app.migration import EmbeddingMigration, MissingSourcesError, check_sources
+
+    current = request.app.state.migration
+    if current is not None and current.running:
+        raise HTTPException(status_code=409, detail="A migration is already running")
+    if target_version == partition.store.embedding_version:
+        raise HTTPException(status_code=409, detail=f"Gallery is already at embedding version {target_version}")
+    if not drop_missing:
+        try:
+            check_sources(partition.store)
+        except MissingSourcesError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    migration = EmbeddingMigration(partition, request.app.state.sources, target_version, drop_missing=drop_missing)
+    request.app.state.migration = migration
+    migration.start()
+    return migration.info()
+
+@router.get("/admin/migrations")
+async def migration_status(request: Request):
+    """Progress of the latest embedding migration."""
+    migration = request.app.state.migration
+    if migration is None:
+        raise HTTPException(status_code=404, detail="No migration has been started")
+    return migration.info()
+
+@router.get("/")
 async def root():
     return {"message": "ZKP Backend API"}
 
-@app.get("/debug")
-async def debug_info(db: Session = Depends(get_db)):
-    """Debug endpoint to check database and FaissStore state"""
-    # Get all users from database
-    all_users = db.query(User).all()
+@router.get("/debug")
+async def debug_info(db: Session = Depends(get_db), faiss_store=Depends(get_store), tenant: str = Depends(get_tenant)):
+    """Debug endpoint to check database and FaissStore state (for the X-Tenant partition)"""
+    # Get all users of the tenant from database
+    all_users = db.query(User).filter(User.tenant == tenant).all()
     db_user_ids = [u.user_id for u in all_users]
     
     # Get all user IDs from FaissStore
-    faiss_user_ids = list(faiss_store.data.keys())
+    faiss_user_ids = faiss_store.user_ids()
     
     return {
         "database_user_ids": db_user_ids,
         "faiss_user_ids": faiss_user_ids,
         "faiss_count": faiss_store.count(),
+        "faiss_user_count": len(faiss_user_ids),
         "db_count": len(db_user_ids)
-    }
\ No newline at end of file
+    }
+
+@router.get("/metrics")
+async def metrics(request: Request):
+    """
+    Admission queue depth, in-flight requests and rejection counts per endpoint;
+    quality gate rejects; search batch sizes; size and search load per gallery partition;
+    user row cache hit rate.
+    """
+    gallery = request.app.state.gallery
+    return {
+        "galleries": {tenant: p.stats() for tenant, p in gallery.partitions.items()},
+        "admission": {name: c.stats() for name, c in request.app.state.admission.items()},
+        "quality": request.app.state.quality.stats(),
+        "search_batching": request.app.state.search_batching.stats(),
+        "user_cache": request.app.state.user_cache.stats(),
+    }
+
+@router.get("/healthz")
+async def healthz(request: Request):
+    """
+    Liveness: 200 while the process is up and the gallery is loading or loaded.
+    503 once warm-up gave up after its retries, so the orchestrator restarts us.
+    """
+    gallery = request.app.state.gallery
+    if gallery.status == "failed":
+        return JSONResponse(status_code=503, content={"status": "failed", "gallery": gallery.info()})
+    return {"status": "ok", "gallery": gallery.info()}
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    """Readiness: 200 only once the gallery is fully loaded."""
+    gallery = request.app.state.gallery
+    info = gallery.info()
+    if gallery.ready:
+        info["count"] = sum(p.store.count() for p in gallery.partitions.values())
+    return JSONResponse(status_code=200 if gallery.ready else 503, content=info)
+
+def create_app(session_factory=SessionLocal, init_schema=None, store_factory=None, admission_limits=None,
+               source_store=None, gallery_dir: str = GALLERY_DIR, user_cache: UserRowCache | None = None) -> FastAPI:
+    """
+    Build the FastAPI application.
+    DB schema creation and gallery loading run in a background warm-up started
+    by the lifespan hook, so workers spawn fast and /readyz stays 503 until
+    the gallery is loaded. admission_limits overrides per-endpoint concurrency;
+    source_store is where enrollment images are retained. store_factory builds
+    the default tenant's store; other tenants' galleries live in gallery_dir.
+    user_cache holds encrypted user rows; it is bound to session_factory so
+    writes invalidate it, and the gallery warm-up pre-warms it.
+    """
+    if init_schema is None:
+        init_schema = lambda: init_db(Base)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.gallery.start()
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.session_factory = session_factory
+    app.state.user_cache = user_cache or UserRowCache()
+    app.state.user_cache.bind(session_factory)
+    app.state.gallery = GalleryLoader(session_factory, init_schema=init_schema, store_factory=store_factory,
+                                      gallery_dir=gallery_dir, user_cache=app.state.user_cache)
+    app.state.admission = build_controllers(admission_limits)
+    app.state.quality = QualityGate()
+    app.state.sources = source_store or SourceImageStore()
+    app.state.migration = None
+    # A batch can't hold more callers than the searching endpoints admit at once
+    app.state.search_batching = SearchCoalescer(
+        max_callers=sum(app.state.admission[name].max_concurrency for name in SEARCH_ENDPOINTS))
+    app.include_router(router)
+    return app
+
+app = create_app()
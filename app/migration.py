@@ -0,0 +1,215 @@
+# app/migration.py
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "64"))  # images per worker task
+MIGRATION_WORKERS = int(os.getenv("MIGRATION_WORKERS", "0"))  # 0 = one per core
+MIGRATION_MAX_CATCH_UP = int(os.getenv("MIGRATION_MAX_CATCH_UP", "10"))  # passes before forcing the final sync
+
+
+def _embed_sources(source_root: str, keys: list, version: int) -> np.ndarray:
+    """Worker task: load retained source images and embed them with `version`."""
+    from app.sources import SourceImageStore
+    from app.fp_utils import embed_images
+
+    sources = SourceImageStore(source_root)
+    return embed_images([sources.get(key) for key in keys], version)
+
+
+class MissingSourcesError(ValueError):
+    """Templates (e.g. from /embeddings/register) that have no source image to re-embed."""
+
+    def __init__(self, template_ids, user_ids):
+        self.template_ids = [int(t) for t in template_ids]
+        self.user_ids = sorted({int(u) for u in user_ids})
+        shown = ", ".join(map(str, self.user_ids[:20])) + (", ..." if len(self.user_ids) > 20 else "")
+        super().__init__(
+            f"{len(self.template_ids)} template(s) of {len(self.user_ids)} user(s) ({shown}) have no source image "
+            f"(registered as embeddings) and can't be re-embedded. Re-enroll them with images, or migrate with "
+            f"drop_missing=true to remove them; users left without templates can't be identified until they re-enroll"
+        )
+
+
+def check_sources(store):
+    """Raise MissingSourcesError if any template of the store lacks a source image."""
+    template_ids, user_ids, sources = store.template_records()
+    missing = np.fromiter((source is None for source in sources), dtype=bool, count=len(sources))
+    if missing.any():
+        raise MissingSourcesError(template_ids[missing], user_ids[missing])
+
+
+class EmbeddingMigration:
+    """
+    Online re-embedding of a live gallery partition to another embedding version.
+    - Re-embeds every template from its retained source image, in batches on a
+      process pool (one worker per core by default)
+    - Builds the new gallery next to the live one; search and registration keep
+      using the live gallery meanwhile
+    - Catches up with templates added or removed during the run, then cuts over
+      atomically: the live store is retired (late writes are re-embedded and
+      forwarded) and the partition points at the new store
+    - Templates without a source image (device-computed) cannot be re-embedded
+      and old-version templates can't be searched with new-version probes: the
+      migration refuses to run (MissingSourcesError) unless drop_missing is set,
+      in which case they are dropped and users left without templates are
+      reported in locked_out_user_ids
+    """
+
+    def __init__(self, partition, source_store, target_version: int, batch_size: int = MIGRATION_BATCH_SIZE,
+                 workers: int = MIGRATION_WORKERS, drop_missing: bool = False):
+        self.partition = partition  # holds the live store (app.gallery.GalleryPartition)
+        self.source_store = source_store
+        self.target_version = target_version
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.drop_missing = drop_missing
+        self.status = "pending"
+        self.from_version = None
+        self.migrated = 0
+        self.total = 0
+        self.missing_source = []  # template ids dropped for lack of a source image
+        self.missing_source_users = []
+        self.locked_out_users = []  # users left without any template
+        self.catch_up_passes = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def start(self):
+        """Start the migration in a daemon thread; returns immediately."""
+        self.status = "running"
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self.run, name="embedding-migration", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.status == "done"
+
+    def run(self):
+        from app.faiss_store import FaissStore
+        from app.fp_utils import embed_images, init_worker
+
+        self.status = "running"
+        self.started_at = self.started_at or time.time()
+        try:
+            live = self.partition.store
+            self.from_version = live.embedding_version
+            if live.retired:
+                raise ValueError("Gallery store was already migrated")
+            if live.embedding_version == self.target_version:
+                raise ValueError(f"Gallery is already at embedding version {self.target_version}")
+            embed_images([], self.target_version)  # fail fast on an unknown version
+
+            new = FaissStore(dim=live.dim, json_path=live.json_path, load=False, embedding_version=self.target_version)
+            new.enroll_lock = live.enroll_lock  # registrations racing the cutover still exclude each other
+            new.enable_ann(live.ann_config)  # same index settings; re-tune for the new embeddings (app/ann_tune.py)
+            done = set()
+
+            # Bulk pass plus catch-up passes while registrations keep arriving;
+            # stop once a pass leaves less than one batch for the final sync.
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker) as pool:
+                while True:
+                    pending = self._pending(*live.template_records(), done)
+                    if self.catch_up_passes and (len(pending[0]) < self.batch_size
+                                                 or self.catch_up_passes > MIGRATION_MAX_CATCH_UP):
+                        break
+                    self._migrate(new, *pending, done, pool)
+                    self.catch_up_passes += 1
+
+            new.build_ann()  # searches on the new store must not pay for the build after cutover
+
+            def reembed(sources):
+                return embed_images([self.source_store.get(key) for key in sources], self.target_version)
+
+            def sync(template_ids, user_ids, sources):
+                self._migrate(new, *self._pending(template_ids, user_ids, sources, done), done)
+                new.drop_templates(np.setdiff1d(np.fromiter(done, dtype=np.int64), template_ids))
+
+            # Cutover. Catch up and write the new gallery without holding the live
+            # store's lock; the handover (a rename and a reference swap) only
+            # happens if no write landed meanwhile, otherwise catch up again.
+            for _ in range(MIGRATION_MAX_CATCH_UP):
+                mutations = live.mutations
+                sync(*live.template_records())
+                if live.retire(new, reembed, staged=new.write_snapshot(), expected_mutations=mutations):
+                    break
+                self.catch_up_passes += 1
+            else:
+                # Writes never paused: final catch-up under the lock (pauses writes and searches briefly)
+                live.retire(new, reembed, sync=sync)
+            self.partition.store = new
+            self.status = "done"
+            remaining = set(new.user_ids())
+            self.locked_out_users = sorted(set(self.missing_source_users) - remaining)
+            print(f"Embedding migration v{self.from_version} -> v{self.target_version} done: "
+                  f"{self.migrated} templates, {len(self.missing_source)} without source dropped")
+            if self.locked_out_users:
+                print(f"WARNING: users {self.locked_out_users} lost all their templates (no source image); "
+                      f"they can't be identified until they re-enroll with images")
+        except Exception as e:
+            print(f"ERROR in embedding migration: {str(e)}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+
+    def _pending(self, template_ids, user_ids, sources, done):
+        """Templates not migrated yet; those without a source are recorded (or fail the run)."""
+        todo = np.fromiter((tid not in done for tid in template_ids.tolist()), dtype=bool, count=len(template_ids))
+        missing = todo & np.fromiter((source is None for source in sources), dtype=bool, count=len(sources))
+        if missing.any():
+            if not self.drop_missing:
+                raise MissingSourcesError(template_ids[missing], user_ids[missing])
+            self.missing_source.extend(template_ids[missing].tolist())
+            self.missing_source_users.extend(np.unique(user_ids[missing]).tolist())
+            done.update(template_ids[missing].tolist())
+        todo &= ~missing
+        self.total = len(done) + int(todo.sum())
+        return template_ids[todo], user_ids[todo], sources[todo]
+
+    def _migrate(self, new, template_ids, user_ids, sources, done, pool=None):
+        """Re-embed templates in batches (on the pool, or inline) and import them into the new store."""
+        starts = range(0, len(template_ids), self.batch_size)
+        batches = [list(sources[i:i + self.batch_size]) for i in starts]
+        root = self.source_store.root
+        if pool is None:
+            results = (_embed_sources(root, keys, self.target_version) for keys in batches)
+        else:
+            results = pool.map(_embed_sources, [root] * len(batches), batches, [self.target_version] * len(batches))
+
+        for i, vectors in zip(starts, results):
+            chunk = slice(i, i + self.batch_size)
+            new.import_templates(vectors, user_ids[chunk], template_ids[chunk], sources[chunk])
+            done.update(template_ids[chunk].tolist())
+            self.migrated += len(vectors)
+
+    def info(self) -> dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "status": self.status,
+            "from_version": self.from_version,
+            "target_version": self.target_version,
+            "migrated": self.migrated,
+            "total": self.total,
+            "missing_source": len(self.missing_source),
+            "locked_out_user_ids": self.locked_out_users,
+            "catch_up_passes": self.catch_up_passes,
+            "workers": self.workers,
+            "elapsed_seconds": elapsed,
+            "error": self.error,
+        }
@@ -4,6 +4,8 @@ from sqlalchemy.sql import func
 
 Base = declarative_base()
 
+DEFAULT_TENANT = "default"  # tenant of requests without X-Tenant (and of pre-tenancy users)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -16,4 +18,10 @@ class User(Base):
     name_tag = Column(LargeBinary, nullable=False)
     age_nonce = Column(LargeBinary, nullable=False)
     age_tag = Column(LargeBinary, nullable=False)
-    status = Column(String(20), default="active")
\ No newline at end of file
+    status = Column(String(20), default="active")
+    # Embedding algorithm version whose primary template derived the AES key
+    key_version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Site / tenant whose gallery partition holds the user's templates
+    tenant = Column(String(64), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT, index=True)
+    # Manifest row the user was enrolled from by app/enroll.py (NULL for API registrations)
+    enroll_key = Column(String(64), unique=True)
\ No newline at end of file
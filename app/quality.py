@@ -0,0 +1,133 @@
+# app/quality.py
+import os
+import time
+import threading
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUALITY_GRID = int(os.getenv("QUALITY_GRID", "64"))  # side of the downsampled check image
+QUALITY_BLOCK = int(os.getenv("QUALITY_BLOCK", "8"))  # block side for the coverage map
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "32"))  # smallest usable source image side (px)
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "0.08"))  # intensity std, 0..1 scale
+QUALITY_MIN_COVERAGE = float(os.getenv("QUALITY_MIN_COVERAGE", "0.6"))  # share of blocks with ridge texture
+QUALITY_BLOCK_STD = float(os.getenv("QUALITY_BLOCK_STD", "0.05"))  # block std counted as textured
+QUALITY_MIN_RIDGE_ENERGY = float(os.getenv("QUALITY_MIN_RIDGE_ENERGY", "0.2"))  # mean Sobel magnitude
+
+
+@dataclass
+class QualityReport:
+    contrast: float
+    coverage: float
+    ridge_energy: float
+
+
+class QualityError(ValueError):
+    """A scan too poor to embed; code is a stable machine-readable reason."""
+
+    def __init__(self, code: str, message: str, report: QualityReport | None = None):
+        super().__init__(message)
+        self.code = code
+        self.report = report
+
+    def detail(self) -> dict:
+        return {
+            "code": self.code,
+            "message": str(self),
+            "metrics": asdict(self.report) if self.report else None,
+        }
+
+
+def assess_quality(img, grid: int = QUALITY_GRID, block: int = QUALITY_BLOCK) -> QualityReport:
+    """Contrast, ridge-texture coverage and ridge energy of a grayscale uint8 image, on a grid x grid downsample."""
+    import cv2
+    import numpy as np
+
+    x = cv2.resize(img, (grid, grid), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+    contrast = float(x.std())
+
+    n = grid // block
+    block_std = x[:n * block, :n * block].reshape(n, block, n, block).std(axis=(1, 3))
+    coverage = float((block_std > QUALITY_BLOCK_STD).mean())
+
+    gx = cv2.Sobel(x, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(x, cv2.CV_32F, 0, 1, ksize=3)
+    ridge_energy = float(cv2.magnitude(gx, gy).mean())
+
+    return QualityReport(contrast=contrast, coverage=coverage, ridge_energy=ridge_energy)
+
+
+def check_quality(img) -> QualityReport:
+    """Raise QualityError for unusable scans; cheapest checks first."""
+    if min(img.shape[:2]) < QUALITY_MIN_SIDE:
+        raise QualityError("IMAGE_TOO_SMALL", f"Image is {img.shape[1]}x{img.shape[0]}, need at least {QUALITY_MIN_SIDE}px per side")
+
+    report = assess_quality(img)
+    if report.contrast < QUALITY_MIN_CONTRAST:
+        raise QualityError("LOW_CONTRAST", "Scan is blank or washed out", report)
+    if report.coverage < QUALITY_MIN_COVERAGE:
+        raise QualityError("LOW_COVERAGE", "Too little of the scan shows ridges (partial or truncated print)", report)
+    if report.ridge_energy < QUALITY_MIN_RIDGE_ENERGY:
+        raise QualityError("LOW_RIDGE_ENERGY", "Ridges are too faint (smudged or out of focus)", report)
+    return report
+
+
+class QualityGate:
+    """
+    Pre-embedding quality check with its own metrics.
+    - check(): timed check_quality(), counting passes and rejects per code
+    - record_pipeline(): time spent on accepted scans after the gate (embedding,
+      search, DB); rejects × its average estimates the work saved
+    """
+
+    def __init__(self, enabled: bool = QUALITY_GATE_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.passed = 0
+        self.rejected = {}
+        self.check_seconds = 0.0
+        self.pipeline_runs = 0
+        self.pipeline_seconds = 0.0
+
+    def check(self, img):
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        try:
+            report = check_quality(img)
+        except QualityError as e:
+            with self._lock:
+                self.rejected[e.code] = self.rejected.get(e.code, 0) + 1
+            raise
+        finally:
+            with self._lock:
+                self.checked += 1
+                self.check_seconds += time.perf_counter() - started
+        with self._lock:
+            self.passed += 1
+        return report
+
+    def record_pipeline(self, seconds: float, count: int = 1):
+        """Post-gate time for `count` accepted requests / bulk entries."""
+        with self._lock:
+            self.pipeline_runs += count
+            self.pipeline_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            rejected_total = sum(self.rejected.values())
+            avg_pipeline = self.pipeline_seconds / self.pipeline_runs if self.pipeline_runs else 0.0
+            return {
+                "enabled": self.enabled,
+                "checked": self.checked,
+                "passed": self.passed,
+                "rejected": dict(self.rejected),
+                "reject_rate": round(rejected_total / self.checked, 4) if self.checked else 0.0,
+                "avg_check_ms": round(1000 * self.check_seconds / self.checked, 3) if self.checked else 0.0,
+                "avg_pipeline_ms": round(1000 * avg_pipeline, 3),
+                "estimated_saved_ms": round(1000 * rejected_total * avg_pipeline, 1),
+            }
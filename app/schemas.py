@@ -1,16 +1,56 @@
-from pydantic import BaseModel
+import os
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Entries per /register/bulk request: all are embedded at once and compared pairwise
+# (an images x images similarity matrix), so this bounds the request's memory
+REGISTER_BULK_MAX_USERS = int(os.getenv("REGISTER_BULK_MAX_USERS", "100"))
 
 class UserRegistrationRequest(BaseModel):
     name: str
     age: int
-    fingerprint_image_path: str  # Path to fingerprint image
+    fingerprint_image_path: Optional[str] = None  # Path to fingerprint image (key-bound primary template)
+    fingerprint_image_paths: list[str] = []  # Extra scans / fingers enrolled as additional templates
     password: str  # User's password for key derivation
 
+    @model_validator(mode="after")
+    def check_images(self):
+        if not self.image_paths:
+            raise ValueError("At least one fingerprint image path is required")
+        return self
+
+    @property
+    def image_paths(self) -> list[str]:
+        """All enrollment images; the first one derives the AES key."""
+        primary = [self.fingerprint_image_path] if self.fingerprint_image_path else []
+        return primary + list(self.fingerprint_image_paths)
+
 class UserRegistrationResponse(BaseModel):
     user_id: int
     status: str
     message: str
+    template_ids: list[int] = []
+
+class BulkRegistrationRequest(BaseModel):
+    users: list[UserRegistrationRequest] = Field(max_length=REGISTER_BULK_MAX_USERS)
+
+class BulkRegistrationResult(BaseModel):
+    index: int  # Position in the request's users list
+    status: str  # success | duplicate | rejected | error
+    message: str
+    code: Optional[str] = None  # Quality gate reason when status is "rejected"
+    user_id: Optional[int] = None
+    template_ids: list[int] = []
+    conflicting_user_id: Optional[int] = None  # Already-enrolled user the finger matched
+    duplicate_of_index: Optional[int] = None  # Earlier entry of the same batch it matched
+    similarity_score: Optional[float] = None
+
+class BulkRegistrationResponse(BaseModel):
+    registered: int
+    results: list[BulkRegistrationResult]
 
 class UserDecryptionRequest(BaseModel):
     fingerprint_image_path: str  # Path to fingerprint image for verification
@@ -22,4 +62,11 @@ class UserDecryptionResponse(BaseModel):
     age: int
     status: str
     message: str
-    similarity_score: float
\ No newline at end of file
+    similarity_score: float
+
+class EmbeddingMatch(BaseModel):
+    user_id: int
+    similarity_score: float
+
+class EmbeddingIdentifyResponse(BaseModel):
+    results: list[list[EmbeddingMatch]]  # One ranked match list per vector in the request body
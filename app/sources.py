@@ -0,0 +1,81 @@
+# app/sources.py
+import os
+import hashlib
+import tempfile
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if TYPE_CHECKING:
+    import numpy as np  # imported lazily: app.main imports this module
+
+SOURCE_IMAGE_DIR = os.getenv("SOURCE_IMAGE_DIR", "./data/sources")
+
+
+class SourceImageStore:
+    """
+    Retained enrollment images, so templates can be re-embedded when the
+    embedding algorithm changes.
+    - Images are the grayscale uint8 arrays the extractor saw, stored as lossless PNG
+    - Content-addressed: the key is the SHA-256 of shape + pixels, so
+      re-enrolling the same scan stores it once
+    """
+
+    def __init__(self, root: str = SOURCE_IMAGE_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    @staticmethod
+    def key_for(image: "np.ndarray") -> str:
+        import numpy as np
+
+        digest = hashlib.sha256(np.asarray(image.shape, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(image).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def encode(cls, image: "np.ndarray") -> tuple[str, bytes]:
+        """(key, PNG bytes) of an image, to be retained later with put_encoded()."""
+        import cv2
+
+        ok, encoded = cv2.imencode(".png", image)
+        if not ok:
+            raise ValueError("Cannot encode source image")
+        return cls.key_for(image), encoded.tobytes()
+
+    def put(self, image: "np.ndarray") -> str:
+        """Retain an image; returns its key."""
+        key = self.key_for(image)
+        if not self.has(key):
+            self.put_encoded(*self.encode(image))
+        return key
+
+    def put_encoded(self, key: str, data: bytes):
+        """Retain an image encoded by encode()."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            directory, name = os.path.split(path)
+            os.makedirs(directory, exist_ok=True)
+            # unique temp name, so concurrent writers of one key never share a file
+            fd, tmp = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except Exception:
+                os.remove(tmp)
+                raise
+
+    def get(self, key: str) -> "np.ndarray":
+        import cv2
+
+        img = cv2.imread(self._path(key), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise KeyError(f"Source image not found: {key}")
+        return img
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
@@ -0,0 +1,171 @@
+# app/user_cache.py
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))  # encrypted rows kept in memory
+
+# session.info keys: user ids written in the current transaction / a bulk write happened
+_PENDING = "user_cache_invalidate"
+_CLEAR = "user_cache_clear"
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Immutable copy of a User row. Holds only ciphertext, nonces and tags; no plaintext."""
+    user_id: int
+    tenant: str
+    status: str | None
+    key_version: int
+    enc_name: bytes
+    enc_age: bytes
+    name_nonce: bytes
+    name_tag: bytes
+    age_nonce: bytes
+    age_tag: bytes
+    updated_at: datetime | None = None
+
+    @classmethod
+    def from_row(cls, row) -> "CachedUser":
+        """From a User instance or a row of cached_columns()."""
+        return cls(**{name: getattr(row, name) for name in cls.__dataclass_fields__})
+
+
+def cached_columns():
+    """User columns a CachedUser is built from (query these instead of whole ORM objects)."""
+    from app.models import User
+    return [getattr(User, name) for name in CachedUser.__dataclass_fields__]
+
+
+class UserRowCache:
+    """
+    Bounded read-through LRU of encrypted User rows keyed by user_id.
+    - A miss loads the row from the DB and keeps it; the least recently used
+      row is evicted beyond max_size
+    - Rows written through a bound session factory (update, delete, status
+      change, re-key) are invalidated at flush and again at commit; a miss
+      that raced with an invalidation is returned but not cached
+    - Pre-warmed from the gallery warm-up stream (app/gallery.py)
+    - Writes made outside the app's sessions (e.g. manual SQL) are only seen
+      after eviction or a restart
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, enabled: bool = USER_CACHE_ENABLED):
+        self.max_size = max_size
+        self.enabled = enabled and max_size > 0
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.prewarmed = 0
+        self._generation = 0  # bumped by every invalidation
+
+    def get(self, db, user_id: int) -> CachedUser | None:
+        """The user's encrypted row, from the cache or else from the DB; None if there is no such user."""
+        if self.enabled:
+            with self._lock:
+                row = self._rows.get(user_id)
+                if row is not None:
+                    self._rows.move_to_end(user_id)
+                    self.hits += 1
+                    return row
+                self.misses += 1
+                generation = self._generation
+
+        from app.models import User
+        found = db.query(*cached_columns()).filter(User.user_id == user_id).first()
+        if found is None:
+            return None  # not cached: the id may be enrolled later
+        row = CachedUser.from_row(found)
+        if self.enabled and user_id not in db.info.get(_PENDING, ()):  # not our own uncommitted write
+            self.put(row, generation)
+        return row
+
+    def put(self, row: CachedUser, generation: int | None = None):
+        """Cache a row; with generation, only if nothing was invalidated since it was read."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._rows[row.user_id] = row
+            self._rows.move_to_end(row.user_id)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def prewarm(self, row) -> bool:
+        """Cache a streamed row while there is room; False once full (pre-warming never evicts)."""
+        if not self.enabled or len(self._rows) >= self.max_size:
+            return False
+        with self._lock:
+            self._rows.setdefault(row.user_id, CachedUser.from_row(row))
+        self.prewarmed += 1
+        return True
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                if self._rows.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._rows)
+            self._rows.clear()
+
+    def bind(self, session_factory):
+        """Invalidate rows written through sessions of session_factory (a sessionmaker)."""
+        from sqlalchemy import event
+        from app.models import User
+
+        def after_flush(session, flush_context):
+            written = {obj.user_id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User)}
+            if written:
+                session.info.setdefault(_PENDING, set()).update(written)
+                self.invalidate(written)
+
+        def do_orm_execute(state):
+            # Bulk query(User).update()/delete(): rows unknown, drop everything at commit
+            if (state.is_update or state.is_delete) and any(m.class_ is User for m in state.all_mappers):
+                state.session.info[_CLEAR] = True
+
+        def after_commit(session):
+            if session.info.pop(_CLEAR, False):
+                self.clear()
+            written = session.info.pop(_PENDING, None)
+            if written:
+                self.invalidate(written)
+
+        def after_rollback(session):
+            session.info.pop(_PENDING, None)
+            session.info.pop(_CLEAR, None)
+
+        event.listen(session_factory, "after_flush", after_flush)
+        event.listen(session_factory, "do_orm_execute", do_orm_execute)
+        event.listen(session_factory, "after_commit", after_commit)
+        event.listen(session_factory, "after_rollback", after_rollback)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._rows),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "prewarmed": self.prewarmed,
+        }
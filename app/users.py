@@ -0,0 +1,31 @@
+# app/users.py
+from app.encryption import encrypt_data
+from app.models import User, DEFAULT_TENANT
+
+# Shared by the API and the offline enrollment CLI (app/enroll.py)
+
+def encrypted_fields(name: str, age: int, password: str, primary_embedding) -> dict:
+    """User columns for name/age encrypted with the key derived from (primary embedding + password)."""
+    from app.key_utils import generate_key_from_embedding
+
+    # Generate AES key from the primary (first) embedding + password
+    aes_key = generate_key_from_embedding(primary_embedding, password)
+
+    # Encrypt name and age
+    enc_name, name_nonce, name_tag = encrypt_data(name, aes_key)
+    enc_age, age_nonce, age_tag = encrypt_data(str(age), aes_key)
+
+    return dict(
+        enc_name=enc_name,
+        enc_age=enc_age,
+        name_nonce=name_nonce,
+        name_tag=name_tag,
+        age_nonce=age_nonce,
+        age_tag=age_tag,
+    )
+
+def build_user_record(name: str, age: int, password: str, primary_embedding, key_version: int,
+                      tenant: str = DEFAULT_TENANT) -> User:
+    """New user whose AES key derives from a primary embedding of the given embedding version."""
+    return User(**encrypted_fields(name, age, password, primary_embedding), status="active", key_version=key_version,
+                tenant=tenant)
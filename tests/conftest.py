@@ -0,0 +1,63 @@
+# tests/conftest.py
+import os, sys, tempfile
+sys.path.append(os.path.abspath("."))
+# app.db builds its engine at import (PostgreSQL by default); tests run on SQLite
+# unless DATABASE_URL is already set. Set once here, before any test module imports app.*
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "zkp_backend_test.db"))
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+SAMPLE_IMAGE = "images/100__M_Left_index_finger.bmp"
+
+
+@pytest.fixture
+def sample_image():
+    """Path of a real fingerprint scan shipped with the repo."""
+    return SAMPLE_IMAGE
+
+
+@pytest.fixture
+def unit_rows():
+    """unit_rows(n, dim, seed=0): n random unit-length float32 rows."""
+    def make(n, dim, seed=0):
+        rows = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+        return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+    return make
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite database file in tmp_path (no tables yet)."""
+    return create_engine(f"sqlite:///{tmp_path / 'users.db'}", future=True)
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
+
+
+@pytest.fixture
+def make_app(tmp_path, engine, session_factory):
+    """
+    make_app(**overrides): create_app() wired to tmp_path (database, gallery files,
+    source images); keyword arguments replace any create_app argument.
+    Calling it again gives a fresh app over the same files, like a restart.
+    """
+    from app.faiss_store import FaissStore
+    from app.main import create_app
+    from app.models import Base
+    from app.sources import SourceImageStore
+
+    def make(**overrides):
+        options = {
+            "init_schema": lambda: Base.metadata.create_all(bind=engine),
+            "store_factory": lambda: FaissStore(json_path=str(tmp_path / "embeddings.json"), load=False),
+            "source_store": SourceImageStore(str(tmp_path / "sources")),
+            "gallery_dir": str(tmp_path / "galleries"),
+        }
+        options.update(overrides)
+        return create_app(session_factory, **options)
+    return make
@@ -0,0 +1,87 @@
+# tests/test_admission.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.admission import (AdmissionController, AdmissionRejected, DeadlineExceeded, deadline_from_headers,
+                           timeout_from_headers)
+
+
+def test_queue_full_and_deadline_are_shed():
+    async def scenario():
+        controller = AdmissionController("decrypt", max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.slot(1.0):
+                await release.wait()
+
+        async def waiter():
+            async with controller.slot(1.0):
+                return "served"
+
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1 and controller.queued == 1
+
+        # Queue is full: rejected immediately
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.slot(1.0):
+                pass
+        assert excinfo.value.reason == "queue_full"
+        assert excinfo.value.retry_after >= 1
+
+        release.set()
+        assert await queued == "served"
+        await held
+
+        # Slot busy and the client's budget runs out while waiting
+        release.clear()
+        held = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.slot(0.01):
+                pass
+        assert excinfo.value.reason == "deadline"
+        release.set()
+        await held
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == {"queue_full": 1, "deadline": 1}
+    assert stats["completed"] == 3
+    assert stats["max_queue_depth"] == 1
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_timeout_header():
+    assert timeout_from_headers({"x-request-timeout-ms": "250"}, default=5.0) == 0.25
+    assert timeout_from_headers({"x-request-timeout-ms": "soon"}, default=5.0) == 5.0
+    assert timeout_from_headers({}, default=5.0) == 5.0
+
+
+def test_deadline_covers_the_whole_request(make_app, sample_image, monkeypatch):
+    deadline = deadline_from_headers({"x-request-timeout-ms": "0"})
+    with pytest.raises(DeadlineExceeded, match="embedding"):
+        deadline.check("embedding")
+    deadline_from_headers({}).check("embedding")  # no header: no deadline once admitted
+
+    app = make_app()
+    with TestClient(app) as client:
+        assert client.app.state.gallery.wait(5)
+        # Admitted right away, but the quality gate alone outlasts the 20 ms budget
+        monkeypatch.setattr(app.state.quality, "check", lambda image: time.sleep(0.05))
+        probe = {"fingerprint_image_path": sample_image, "password": "pw"}
+        r = client.post("/decrypt", json=probe, headers={"X-Request-Timeout-Ms": "20"})
+        assert r.status_code == 504 and "after loading images" in r.json()["detail"]
+        assert client.post("/decrypt", json=probe).status_code == 404  # served to the end without a deadline
+
+        decrypt = client.get("/metrics").json()["admission"]["decrypt"]
+        assert decrypt["in_flight"] == 0 and decrypt["completed"] == 2
@@ -0,0 +1,83 @@
+# tests/test_ann.py
+import os, sys, time
+sys.path.append(os.path.abspath("."))
+
+import numpy as np
+
+from app.ann import load_ann_config, save_ann_config
+from app.ann_tune import sample_probes, tune
+from app.faiss_store import FaissStore
+from app.gallery import GalleryLoader
+
+HNSW = {"kind": "hnsw", "params": {"M": 16, "efSearch": 32}, "candidates": 4}
+
+
+def make_store(tmp_path, n_users=300, per_user=2):
+    rng = np.random.default_rng(7)
+    centers = rng.standard_normal((n_users, 128)).astype(np.float32)
+    vectors = np.repeat(centers, per_user, axis=0) + 0.2 * rng.standard_normal((n_users * per_user, 128)).astype(np.float32)
+    store = FaissStore(json_path=str(tmp_path / "embeddings.json"), load=False)
+    store.add_batch(vectors, np.repeat(np.arange(1, n_users + 1), per_user))
+    return store, centers
+
+
+def test_ann_search_matches_exact_and_tracks_writes(tmp_path):
+    store, centers = make_store(tmp_path)
+    probes = sample_probes(store, 100, noise=0.3)
+    exact = store.search_similar_batch(probes, k=3)
+
+    store.enable_ann(HNSW)
+    assert store.build_ann()
+    approx = store.search_similar_batch(probes, k=3)
+    assert [r[0][0] for r in approx] == [r[0][0] for r in exact]
+    # Candidates are re-scored exactly, so scores agree with brute force
+    assert np.allclose([r[0][1] for r in approx], [r[0][1] for r in exact], atol=1e-5)
+    assert store.stats()["index"] == "hnsw" and store.ann_nbytes() > 0
+
+    # Templates added or removed after the index was built are picked up
+    store.add_templates(centers[0] * -1, user_id=999)
+    assert store.search_similar(centers[0] * -1)[0][0] == 999
+    store.remove_user(1)
+    assert all(uid != 1 for uid, _ in store.search_similar(centers[0], k=5))
+
+    # A reduction the index can't serve falls back to brute force
+    assert store.search_similar(centers[2], reduce="mean")[0][0] == 3
+
+
+def test_tune_saves_cheapest_config_meeting_target(tmp_path):
+    store, _ = make_store(tmp_path)
+    probes = sample_probes(store, 50, noise=0.3)
+    best, rows = tune(store, probes, k=3, target_recall=0.98, latency_queries=10, log=lambda *_: None)
+
+    assert {"exact", "flat", "hnsw"} <= {r["kind"] for r in rows}
+    assert best["recall_at_1"] >= 0.98
+    assert best["p50_ms"] == min(r["p50_ms"] for r in rows if r["recall_at_1"] >= 0.98)
+    assert store.ann_config is None  # left on brute force
+
+    path = str(tmp_path / "ann_config.json")
+    save_ann_config("site-a", HNSW, path)
+    save_ann_config("default", {"kind": "exact"}, path)
+    assert load_ann_config("site-a", path)["params"] == HNSW["params"]
+    assert load_ann_config("default", path) is None and load_ann_config("site-b", path) is None
+
+    # Warm-up gives each tenant's store its tuned index
+    loader = GalleryLoader(None, gallery_dir=str(tmp_path / "galleries"), ann_config_path=path)
+    assert loader._new_store("site-a").ann_config["kind"] == "hnsw"
+
+
+def test_stale_index_rebuilds_in_background(tmp_path):
+    store, centers = make_store(tmp_path)
+    store.enable_ann(HNSW)
+    assert store.build_ann()
+    index = store._ann.index
+    for user_id in range(1, 100):
+        store.remove_user(user_id)
+
+    # Served exactly meanwhile, then the rebuilt index is swapped in
+    assert store.search_similar(centers[150])[0][0] == 151
+    for _ in range(100):
+        if store._ann.index is not index:
+            break
+        time.sleep(0.05)
+    assert store._ann.index is not index and store._ann.index.ntotal == store.count()
+    assert store.search_similar(centers[150])[0][0] == 151
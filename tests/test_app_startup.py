@@ -0,0 +1,97 @@
+# tests/test_app_startup.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import subprocess
+import threading
+
+from fastapi.testclient import TestClient
+
+from app.faiss_store import FaissStore
+from app.models import Base, User
+
+
+def test_import_has_no_side_effects():
+    import app.main
+    assert app.main.app.state.gallery.status == "pending"
+
+    # Heavy modules load in the warm-up thread, not at import (fresh interpreter:
+    # other tests have imported them into this one)
+    check = "import sys, app.main; print(sorted(m for m in ('numpy', 'cv2', 'faiss') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_readyz_reports_loading_then_ready(tmp_path, engine, make_app):
+    release = threading.Event()
+
+    def init_schema():
+        release.wait(5)
+        Base.metadata.create_all(bind=engine)
+
+    json_path = str(tmp_path / "embeddings.json")
+    app = make_app(init_schema=init_schema, store_factory=lambda: FaissStore(json_path=json_path, load=False))
+
+    with TestClient(app) as client:
+        assert client.get("/healthz").status_code == 200
+        r = client.get("/readyz")
+        assert r.status_code == 503
+        assert r.json()["status"] == "loading"
+        assert client.get("/debug").status_code == 503
+
+        release.set()
+        assert app.state.gallery.wait(5)
+        r = client.get("/readyz")
+        assert r.status_code == 200
+        assert r.json()["count"] == 0
+
+
+def test_warmup_drops_embeddings_of_deleted_users(tmp_path, engine, session_factory, make_app):
+    Base.metadata.create_all(bind=engine)
+    db = session_factory()
+    user = User(enc_name=b"n", enc_age=b"a", name_nonce=b"0", name_tag=b"0", age_nonce=b"0", age_tag=b"0")
+    db.add(user)
+    db.commit()
+    kept_id = user.user_id
+    db.close()
+
+    json_path = str(tmp_path / "embeddings.json")
+    seed = FaissStore(json_path=json_path)
+    seed.add([0.1] * seed.dim, kept_id)
+    seed.add([0.2] * seed.dim, kept_id + 100)
+
+    app = make_app(init_schema=lambda: None, store_factory=lambda: FaissStore(json_path=json_path, load=False))
+    with TestClient(app) as client:
+        assert app.state.gallery.wait(5)
+        body = client.get("/readyz").json()
+        assert body["count"] == 1
+        assert body["total"] == 2
+        assert client.get("/debug").json()["faiss_user_ids"] == [kept_id]
+
+
+def test_failed_warmup_is_retried_then_fails_liveness(engine, make_app):
+    calls = []
+
+    def flaky_schema():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("database unreachable")
+        Base.metadata.create_all(bind=engine)
+
+    app = make_app(init_schema=flaky_schema)
+    app.state.gallery.backoff = 0.01
+    with TestClient(app) as client:
+        assert app.state.gallery.wait(5)
+        assert app.state.gallery.attempts == 3
+        assert client.get("/readyz").json()["error"] is None
+
+    def down():
+        raise RuntimeError("database unreachable")
+
+    app = make_app(init_schema=down)
+    app.state.gallery.backoff = 0.01
+    app.state.gallery.retries = 1
+    with TestClient(app) as client:
+        assert not app.state.gallery.wait(5)
+        r = client.get("/healthz")
+        assert r.status_code == 503 and r.json()["gallery"]["attempts"] == 2
@@ -0,0 +1,76 @@
+# tests/test_batching.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.batching import SearchCoalescer
+from app.faiss_store import FaissStore
+
+
+def test_concurrent_queries_share_one_search(tmp_path, unit_rows):
+    store = FaissStore(dim=8, json_path=str(tmp_path / "g.json"))
+    store.add_batch(unit_rows(50, 8, seed=1), np.arange(50) % 20)
+    queries = unit_rows(10, 8, seed=2)
+
+    async def scenario():
+        coalescer = SearchCoalescer(window_ms=50, max_batch=6)
+        calls = [coalescer.search(store, q, k=1 + i % 3) for i, q in enumerate(queries[:9])]
+        calls.append(coalescer.search(store, queries[9:], k=2))
+        return coalescer, await asyncio.gather(*calls)
+
+    coalescer, results = asyncio.run(scenario())
+
+    for i, (query, result) in enumerate(zip(queries, results)):
+        k = 2 if i == 9 else 1 + i % 3
+        direct = store.search_similar(query, k=k)
+        assert len(result) == 1
+        assert [uid for uid, _ in result[0]] == [uid for uid, _ in direct]
+        assert [s for _, s in result[0]] == pytest.approx([s for _, s in direct], abs=1e-6)
+
+    # 10 rows with max_batch 6: one full batch flushed early, the rest on the window
+    stats = coalescer.stats()
+    assert stats["batches"] == 2 and stats["queries"] == 10 and stats["max_batch_size"] == 6
+
+
+def test_search_from_thread_without_event_loop(tmp_path, unit_rows):
+    store = FaissStore(dim=8, json_path=str(tmp_path / "g.json"))
+    store.add_batch(unit_rows(5, 8), np.arange(5))
+    coalescer = SearchCoalescer()
+    assert coalescer.search_from_thread(store, unit_rows(1, 8), k=1)[0][0][0] == 0
+    assert coalescer.stats()["batches"] == 0
+
+
+def test_batch_goes_once_every_admitted_caller_waits(tmp_path, unit_rows):
+    store = FaissStore(dim=8, json_path=str(tmp_path / "g.json"))
+    store.add_batch(unit_rows(5, 8), np.arange(5))
+
+    async def scenario():
+        coalescer = SearchCoalescer(window_ms=10_000, max_callers=3)
+        await asyncio.wait_for(asyncio.gather(*[coalescer.search(store, q) for q in unit_rows(3, 8)]), 5)
+        return coalescer.stats()
+
+    assert asyncio.run(scenario())["max_batch_size"] == 3
+
+
+def test_search_errors_propagate_from_thread(tmp_path, unit_rows):
+    calls = []
+
+    class Failing(FaissStore):
+        def search_similar_batch(self, queries, k=1):
+            calls.append(k)
+            raise RuntimeError("index broken")
+
+    store = Failing(dim=8, json_path=str(tmp_path / "g.json"))
+    coalescer = SearchCoalescer(window_ms=1)
+
+    async def scenario():
+        import anyio.to_thread
+        return await anyio.to_thread.run_sync(coalescer.search_from_thread, store, unit_rows(1, 8))
+
+    with pytest.raises(RuntimeError, match="index broken"):
+        asyncio.run(scenario())
+    assert len(calls) == 1 and coalescer.stats()["batches"] == 0  # not retried unbatched
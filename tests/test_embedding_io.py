@@ -0,0 +1,105 @@
+# tests/test_embedding_io.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import numpy as np
+import pytest
+
+from app.embedding_io import EmbeddingFormatError, parse_embeddings
+from app.faiss_store import FaissStore
+
+
+def test_parse_is_zero_copy_and_validated(unit_rows):
+    rows = unit_rows(3, 8)
+    body = rows.astype("<f4").tobytes()
+
+    parsed = parse_embeddings(body, dim=8)
+    assert parsed.shape == (3, 8)
+    assert np.array_equal(parsed, rows)
+    assert not parsed.flags.writeable  # view over the request bytes
+
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings(body[:-4], dim=8)
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings(b"", dim=8)
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings(body, dim=8, max_batch=2)
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings((rows * 2).astype("<f4").tobytes(), dim=8)
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings(np.zeros(8, "<f4").tobytes(), dim=8)
+    with pytest.raises(EmbeddingFormatError):
+        parse_embeddings(np.full(8, np.nan, "<f4").tobytes(), dim=8)
+
+
+def test_batch_search_matches_single_search(tmp_path, unit_rows):
+    store = FaissStore(dim=8, json_path=str(tmp_path / "g.json"))
+    gallery = unit_rows(40, 8, seed=1)
+    store.add_batch(gallery, np.arange(40) % 15)
+
+    queries = unit_rows(6, 8, seed=2)
+    batch = store.search_similar_batch(queries, k=3)
+    for query, result in zip(queries, batch):
+        single = store.search_similar(query, k=3)
+        assert [uid for uid, _ in result] == [uid for uid, _ in single]
+        assert [score for _, score in result] == pytest.approx([score for _, score in single], abs=1e-6)
+
+    assert store.score_user(gallery[0], 0) == pytest.approx(1.0)
+    assert store.score_user(gallery[0], 99) is None
+
+
+def test_embedding_endpoints(make_app, unit_rows):
+    from fastapi.testclient import TestClient
+    from app.embedding_io import EMBEDDING_MAX_BATCH
+    from app.fp_utils import EMBED_DIM
+
+    octet = {"Content-Type": "application/octet-stream"}
+    ann, bob = unit_rows(2, EMBED_DIM, seed=3)
+
+    def post(path, rows, params=None, password="pw", headers=octet):
+        body = np.asarray(rows, dtype="<f4").tobytes()
+        return client.post(path, params=params, content=body, headers={**headers, "X-Password": password})
+
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+
+        # /embeddings/register: 200, then 409 for the same template
+        response = post("/embeddings/register", [ann], {"name": "Ann", "age": 30})
+        assert response.status_code == 200, response.text
+        ann_id = response.json()["user_id"]
+        response = post("/embeddings/register", [bob], {"name": "Bob", "age": 40}, password="pw2")
+        assert response.status_code == 200, response.text
+        bob_id = response.json()["user_id"]
+        assert post("/embeddings/register", [ann], {"name": "Eve", "age": 22}).status_code == 409
+
+        # /embeddings/identify: one result row per query, best match first
+        response = post("/embeddings/identify", [bob, ann], {"k": 2})
+        assert response.status_code == 200, response.text
+        results = response.json()["results"]
+        assert [row[0]["user_id"] for row in results] == [bob_id, ann_id]
+        assert results[0][0]["similarity_score"] == pytest.approx(1.0, abs=1e-5)
+
+        # /embeddings/verify: 1:N without user_id, 1:1 with it
+        response = post("/embeddings/verify", [ann])
+        assert response.status_code == 200, response.text
+        assert (response.json()["user_id"], response.json()["name"], response.json()["age"]) == (ann_id, "Ann", 30)
+        response = post("/embeddings/verify", [bob], {"user_id": bob_id}, password="pw2")
+        assert response.status_code == 200 and response.json()["name"] == "Bob"
+
+        for path, params in [("/embeddings/identify", None), ("/embeddings/verify", None),
+                             ("/embeddings/verify", {"user_id": ann_id}),
+                             ("/embeddings/register", {"name": "Cy", "age": 50})]:
+            # 415: only raw float32 bodies are accepted
+            assert post(path, [ann], params, headers={"Content-Type": "application/json"}).status_code == 415, path
+            # 422: truncated vector, non-unit norm
+            body = np.asarray([ann], dtype="<f4").tobytes()[:-4]
+            response = client.post(path, params=params, content=body, headers={**octet, "X-Password": "pw"})
+            assert response.status_code == 422, path
+            assert post(path, [ann * 2], params).status_code == 422, path
+
+        # 422: over the batch limit (verify takes exactly one vector)
+        oversize = unit_rows(EMBEDDING_MAX_BATCH + 1, EMBED_DIM, seed=4)
+        assert post("/embeddings/identify", oversize).status_code == 422
+        assert post("/embeddings/register", oversize, {"name": "Cy", "age": 50}).status_code == 422
+        assert post("/embeddings/verify", [ann, bob]).status_code == 422
+        assert post("/embeddings/verify", [ann, bob], {"user_id": ann_id}).status_code == 422
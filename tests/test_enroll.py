@@ -0,0 +1,84 @@
+# tests/test_enroll.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import csv
+
+import cv2
+import numpy as np
+
+from app.enroll import EnrollmentRun
+from app.faiss_store import FaissStore
+from app.models import Base, User
+from app.sources import SourceImageStore
+
+
+def write_manifest(tmp_path, n=6):
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(n):
+        cv2.imwrite(str(tmp_path / f"{i}.bmp"), rng.integers(0, 256, (96, 103), dtype=np.uint8))
+        rows.append({"name": f"user{i}", "age": 20 + i, "password": f"pw{i}", "image": f"{i}.bmp"})
+    cv2.imwrite(str(tmp_path / "blank.bmp"), np.full((96, 103), 200, np.uint8))
+    rows.append({"name": "blank", "age": 1, "password": "x", "image": "blank.bmp"})  # quality reject
+    rows.append({"name": "again", "age": 1, "password": "x", "image": "0.bmp"})  # duplicate of row 1
+    rows.append({"name": "missing", "age": 1, "password": "x", "image": "nope.bmp"})  # unreadable
+    near = cv2.imread(str(tmp_path / "1.bmp"), cv2.IMREAD_GRAYSCALE)
+    near[0, 0] ^= 1
+    cv2.imwrite(str(tmp_path / "near.bmp"), near)
+    rows.append({"name": "near", "age": 1, "password": "x", "image": "near.bmp"})  # duplicate of row 2
+
+    manifest = tmp_path / "manifest.csv"
+    with open(manifest, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["name", "age", "password", "image"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(manifest)
+
+
+def test_enrollment_is_chunked_and_resumable(tmp_path, engine, session_factory):
+    manifest = write_manifest(tmp_path)
+    Base.metadata.create_all(bind=engine)
+    json_path = str(tmp_path / "embeddings.json")
+    sources = SourceImageStore(str(tmp_path / "sources"))
+    log = []
+
+    def enrollment(store):
+        return EnrollmentRun(manifest, session_factory, store, sources, "site-a", chunk_size=4, workers=2,
+                             log=log.append, checkpoint_seconds=3600)
+
+    # Interrupted after the first chunk...
+    state = enrollment(FaissStore(json_path=json_path)).run(max_chunks=1)
+    assert state["rows_done"] == 4 and state["enrolled"] == 4
+    assert FaissStore(json_path=json_path).count() == 4
+
+    # ...then a crash after committing the second chunk but before its checkpoint:
+    # neither the gallery JSON nor the checkpoint saw it
+    crashed = enrollment(FaissStore(json_path=json_path))
+    crashed._checkpoint = lambda: None
+    crashed.run(max_chunks=1)
+    db = session_factory()
+    assert db.query(User).count() == 6 and FaissStore(json_path=json_path).count() == 4
+    db.close()
+
+    # Resumed by a new process: the committed rows keep their users and get their templates back
+    store = FaissStore(json_path=json_path)
+    state = enrollment(store).run()
+    assert state == {**state, "rows_done": 10, "enrolled": 6, "duplicate": 2, "rejected": 1, "error": 1}
+    assert "resuming" in log[1] and "rows/s" in log[-1]
+
+    db = session_factory()
+    users = db.query(User).all()
+    assert sorted(u.tenant for u in users) == ["site-a"] * 6
+    assert sorted(store.user_ids()) == sorted(u.user_id for u in users)
+    assert FaissStore(json_path=json_path).count() == 6
+    # Sources only for committed rows (the near-duplicate scan wasn't kept)
+    assert len(list((tmp_path / "sources").rglob("*.png"))) == 6
+
+    with open(f"{manifest}.report.csv") as f:
+        report = {int(r["row"]): r for r in csv.DictReader(f)}
+    assert sorted(report) == [7, 8, 9, 10]
+    assert report[7]["code"] == "LOW_CONTRAST"
+    assert report[8]["status"] == "duplicate"
+    assert report[9]["status"] == "error"
+    assert report[10]["status"] == "duplicate"
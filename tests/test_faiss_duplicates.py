@@ -0,0 +1,114 @@
+# tests/test_faiss_duplicates.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import numpy as np
+
+from app.faiss_store import DUPLICATE_THRESHOLD, FaissStore, duplicates_within_batch
+
+
+def test_find_duplicates_against_gallery(tmp_path):
+    store = FaissStore(dim=4, json_path=str(tmp_path / "g.json"))
+    assert store.find_duplicates([[1, 0, 0, 0]]) == [None]
+
+    store.add_templates([[1, 0, 0, 0], [0, 1, 0, 0]], user_id=3)
+    hits = store.find_duplicates([[0, 2, 0, 0], [0, 0, 1, 0], [1, 0.01, 0, 0]], threshold=0.99)
+
+    assert hits[0] == (3, 1.0)
+    assert hits[1] is None
+    assert hits[2][0] == 3
+
+
+def test_duplicates_within_batch_keeps_first_occurrence():
+    a, b, c = [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]
+    # Entry 0 = [a, b], entry 1 = [c], entry 2 = [b] (dup of 0), entry 3 = [c] (dup of 1)
+    rows = np.array([a, b, c, b, c], dtype=np.float32)
+    groups = np.array([0, 0, 1, 2, 3])
+
+    result = duplicates_within_batch(rows, groups, threshold=0.99)
+    assert result[0] is None and result[1] is None
+    assert result[2][0] == 0
+    assert result[3][0] == 1
+
+    # Images of the same entry never conflict with each other
+    assert duplicates_within_batch(np.array([a, a]), np.array([0, 0]), threshold=0.99) == [None]
+
+
+def test_batch_duplicates_only_count_accepted_entries(tmp_path):
+    store = FaissStore(dim=4, json_path=str(tmp_path / "g.json"))
+    store.add_templates([[1, 0, 0, 0]], user_id=3)
+    # A duplicates the gallery; B only resembles A; C is B again
+    rows = np.array([[1, 0.1, 0, 0], [1, 0.2, 0, 0], [1, 0.2, 0, 0]], dtype=np.float32)
+
+    gallery_hits = {i: hit for i, hit in enumerate(store.find_duplicates(rows, threshold=0.99)) if hit is not None}
+    assert list(gallery_hits) == [0]
+
+    result = duplicates_within_batch(rows, threshold=0.99, rejected=gallery_hits.keys())
+    # B is registered even though it matches the rejected A; C then duplicates B
+    assert result[0] is None and result[1] is None
+    assert result[2][0] == 1
+
+    # Chains inside the batch: X rejected as a duplicate of W doesn't block Y ≈ X
+    chain = np.array([[1, 0, 0, 0], [1, 0.1, 0, 0], [1, 0.2, 0, 0]], dtype=np.float32)
+    result = duplicates_within_batch(chain, threshold=0.99)
+    assert result[1][0] == 0 and result[2] is None
+
+
+def test_bulk_registration_size_is_bounded(make_app, sample_image):
+    from fastapi.testclient import TestClient
+    from app.schemas import REGISTER_BULK_MAX_USERS
+
+    user = {"name": "Ann", "age": 30, "fingerprint_image_path": sample_image, "password": "pw"}
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        r = client.post("/register/bulk", json={"users": [user] * (REGISTER_BULK_MAX_USERS + 1)})
+        assert r.status_code == 422
+
+
+def test_concurrent_enrollments_of_one_finger(tmp_path, make_app, sample_image):
+    import threading
+    import time
+    from fastapi.testclient import TestClient
+
+    class SlowCheck(FaissStore):
+        def find_duplicates(self, embeddings, threshold=DUPLICATE_THRESHOLD):
+            hits = super().find_duplicates(embeddings, threshold)
+            time.sleep(0.1)  # both requests would pass the check without the enrollment lock
+            return hits
+
+    app = make_app(store_factory=lambda: SlowCheck(json_path=str(tmp_path / "embeddings.json"), load=False))
+    user = {"name": "Ann", "age": 30, "fingerprint_image_path": sample_image, "password": "pw"}
+    with TestClient(app) as client:
+        assert client.app.state.gallery.wait(5)
+        codes = []
+        threads = [threading.Thread(target=lambda: codes.append(client.post("/register", json=user).status_code))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(codes) == [200, 409]
+        assert client.app.state.gallery.store.user_count() == 1
+
+
+def test_bulk_registration_reads_no_rows_back(tmp_path, engine, make_app, sample_image):
+    import cv2
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    rng = np.random.default_rng(3)
+    base = cv2.imread(sample_image, cv2.IMREAD_GRAYSCALE)
+    users = []
+    for i in range(3):
+        path = str(tmp_path / f"{i}.png")
+        cv2.imwrite(path, np.roll(base, 25 * (i + 1), axis=i % 2))  # distinct fingers as far as the gallery goes
+        users.append({"name": f"user{i}", "age": 20 + i, "fingerprint_image_path": path, "password": "pw"})
+
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda conn, cursor, sql, *args: statements.append(sql))
+        r = client.post("/register/bulk", json={"users": users})
+        assert r.json()["registered"] == 3, r.json()
+        assert len({res["user_id"] for res in r.json()["results"]}) == 3
+        assert not [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
@@ -0,0 +1,64 @@
+# tests/test_faiss_templates.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import json
+import numpy as np
+
+from app.faiss_store import FaissStore, group_by_user, reduce_by_user
+
+
+def unit(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_many_templates_per_user(tmp_path):
+    store = FaissStore(dim=4, json_path=str(tmp_path / "g.json"))
+    t1 = store.add_templates([[1, 0, 0, 0], [0, 1, 0, 0]], user_id=7)
+    t2 = store.add([0, 0, 1, 0], user_id=9)
+
+    assert t1 == [1, 2] and t2 == 3
+    assert store.count() == 3
+    assert store.user_ids() == [7, 9]
+    assert store.templates_for_user(7) == [1, 2]
+
+    # Either of user 7's templates identifies user 7
+    assert store.search_similar([0, 1, 0, 0], k=1)[0] == (7, 1.0)
+    assert store.search_similar([1, 0, 0, 0], k=2) == [(7, 1.0), (9, 0.0)]
+
+    # Mean reduction averages over the user's templates
+    uid, score = store.search_similar([1, 0, 0, 0], k=1, reduce="mean")[0]
+    assert uid == 7 and abs(score - 0.5) < 1e-6
+
+    # Reload keeps template ids and ownership
+    reloaded = FaissStore(dim=4, json_path=str(tmp_path / "g.json"))
+    assert reloaded.templates_for_user(7) == [1, 2]
+    assert reloaded.add([0, 0, 0, 1], user_id=9) == 4
+
+    assert reloaded.remove_user(7) == 2
+    assert reloaded.user_ids() == [9]
+
+
+def test_segment_reduce_matches_python_loop():
+    rng = np.random.default_rng(0)
+    user_ids = rng.integers(0, 50, size=500)
+    scores = rng.random((3, 500)).astype(np.float32)
+    grouping = group_by_user(user_ids)
+
+    best = reduce_by_user(scores, grouping, "max")
+    mean = reduce_by_user(scores, grouping, "mean")
+    for col, uid in enumerate(grouping[3]):
+        mask = user_ids == uid
+        assert np.allclose(best[:, col], scores[:, mask].max(axis=1))
+        assert np.allclose(mean[:, col], scores[:, mask].mean(axis=1))
+
+
+def test_legacy_json_is_migrated(tmp_path):
+    path = tmp_path / "legacy.json"
+    path.write_text(json.dumps({"5": unit([1, 2, 3, 4]).tolist(), "6": unit([4, 3, 2, 1]).tolist()}))
+
+    store = FaissStore(dim=4, json_path=str(path))
+    assert store.user_ids() == [5, 6]
+    assert store.search_similar(unit([1, 2, 3, 4]), k=1)[0][0] == 5
+    assert "templates" in json.loads(path.read_text())
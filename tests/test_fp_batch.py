@@ -0,0 +1,56 @@
+# tests/test_fp_batch.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import cv2
+import numpy as np
+
+from app.fp_utils import get_fingerprint_embedding, get_fingerprint_embeddings
+
+def legacy_embedding(image_path):
+    """The original single-image pipeline, kept as a reference."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    img = cv2.resize(img, (224, 224))
+    img = img.astype(np.float32) / 255.0
+    img = cv2.equalizeHist((img * 255).astype(np.uint8)).astype(np.float32) / 255.0
+    patch = cv2.resize(img, (32, 32)).flatten()
+    gx = cv2.Sobel(img, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(img, cv2.CV_32F, 0, 1, ksize=3)
+    grad_features = cv2.resize(cv2.magnitude(gx, gy), (32, 32)).flatten()
+    combined = np.concatenate([patch, grad_features])
+    embedding = combined / np.linalg.norm(combined)
+    return np.resize(embedding, 128).astype(np.float32)
+
+
+def synthetic_images(tmp_path, sample_image, n=24):
+    rng = np.random.default_rng(0)
+    base = cv2.imread(sample_image, cv2.IMREAD_GRAYSCALE)
+    paths = [sample_image]
+    for i in range(n):
+        h, w = (int(v) for v in rng.integers(60, 400, 2))
+        if i % 2:
+            img = cv2.GaussianBlur(rng.integers(0, 256, (h, w), dtype=np.uint8), (9, 9), 3)
+        else:
+            img = cv2.resize(np.roll(base, int(rng.integers(0, 60)), axis=i % 3 % 2), (w, h))
+        path = str(tmp_path / f"{i}.png")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def test_sample_matches_legacy_pipeline(sample_image):
+    assert get_fingerprint_embedding(sample_image).tobytes() == legacy_embedding(sample_image).tobytes()
+
+
+def test_batch_is_bit_identical_to_single(tmp_path, sample_image):
+    paths = synthetic_images(tmp_path, sample_image)
+    single = np.stack([get_fingerprint_embedding(p) for p in paths])
+
+    batch = get_fingerprint_embeddings(paths)
+    assert batch.dtype == np.float32 and batch.shape == (len(paths), 128)
+    assert batch.tobytes() == single.tobytes()
+
+    # Arrays and paths can be mixed, and batch boundaries don't matter
+    arrays = [cv2.imread(p, cv2.IMREAD_GRAYSCALE) for p in paths[:5]]
+    assert get_fingerprint_embeddings(arrays + paths[5:]).tobytes() == single.tobytes()
+    assert get_fingerprint_embeddings(paths[3:4]).tobytes() == single[3:4].tobytes()
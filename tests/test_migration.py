@@ -0,0 +1,172 @@
+# tests/test_migration.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import app.fp_utils as fp_utils
+from app.faiss_store import FaissStore
+from app.migration import EmbeddingMigration, MissingSourcesError, check_sources
+from app.sources import SourceImageStore
+
+
+def reversed_extractor(images):
+    return np.ascontiguousarray(fp_utils.get_fingerprint_embeddings(images)[:, ::-1])
+
+
+@pytest.fixture
+def v2_extractor(monkeypatch):
+    monkeypatch.setitem(fp_utils.EXTRACTORS, 2, reversed_extractor)
+
+
+def scans(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (96, 103), dtype=np.uint8) for _ in range(n)]
+
+
+def live_gallery(tmp_path, images):
+    sources = SourceImageStore(str(tmp_path / "src"))
+    store = FaissStore(dim=fp_utils.EMBED_DIM, json_path=str(tmp_path / "g.json"), embedding_version=1)
+    keys = [sources.put(image) for image in images]
+    store.add_batch(fp_utils.embed_images(images, 1), np.arange(len(images)) // 2 + 1, keys)
+    return SimpleNamespace(store=store), sources
+
+
+def test_migration_reembeds_and_cuts_over(tmp_path, v2_extractor):
+    images = scans(10)
+    gallery, sources = live_gallery(tmp_path, images)
+    live = gallery.store
+    live.remove_user(5)  # its template ids must not be reused by the new store
+
+    migration = EmbeddingMigration(gallery, sources, target_version=2, batch_size=3, workers=2)
+    migration.run()
+    assert migration.status == "done", migration.error
+
+    new = gallery.store
+    assert new is not live and live.retired
+    assert new.embedding_version == 2
+    template_ids, user_ids, _ = new.template_records()
+    assert template_ids.tolist() == list(range(1, 9))
+    assert np.allclose(new._vectors[:new.count()], reversed_extractor(images[:8]))
+
+    # Persisted atomically at the live path and reloadable as v2
+    reloaded = FaissStore(dim=fp_utils.EMBED_DIM, json_path=live.json_path)
+    assert reloaded.embedding_version == 2 and reloaded.count() == 8
+
+    # A late write to the retired store is re-embedded into the new one
+    late = scans(1, seed=1)
+    ids = live.add_templates(fp_utils.embed_images(late, 1), 7, [sources.put(late[0])])
+    assert ids == [11]
+    assert new.search_similar(reversed_extractor(late)[0])[0][0] == 7
+
+
+def test_migration_without_sources_leaves_live_gallery(tmp_path, v2_extractor):
+    gallery, sources = live_gallery(tmp_path, scans(4))
+    live = gallery.store
+    live.add_templates(np.ones(fp_utils.EMBED_DIM, dtype=np.float32) / 16, 9)  # device-computed, no source
+
+    with pytest.raises(MissingSourcesError) as e:
+        check_sources(live)
+    assert e.value.user_ids == [9] and "drop_missing" in str(e.value)
+
+    migration = EmbeddingMigration(gallery, sources, target_version=2, workers=1)
+    migration.run()
+    assert migration.status == "failed" and "no source image" in migration.error
+    assert gallery.store is live and not live.retired
+
+    migration = EmbeddingMigration(gallery, sources, target_version=2, workers=1, drop_missing=True)
+    migration.run()
+    assert migration.status == "done"
+    assert migration.missing_source == [5]
+    assert 9 not in gallery.store.user_ids()
+    # Dropping them is not silent: the users left without templates are reported
+    assert migration.info()["locked_out_user_ids"] == [9]
+
+
+def test_cutover_only_when_no_write_landed(tmp_path, v2_extractor):
+    gallery, sources = live_gallery(tmp_path, scans(2))
+    live = gallery.store
+    new = FaissStore(dim=fp_utils.EMBED_DIM, json_path=live.json_path, load=False, embedding_version=2)
+
+    stale = live.mutations
+    live.add_templates(fp_utils.embed_images(scans(1, seed=3), 1), 3)
+    staged = new.write_snapshot()
+    assert not live.retire(new, None, staged=staged, expected_mutations=stale)
+    assert not live.retired and not os.path.exists(staged)
+
+    # A retired store's in-flight save doesn't clobber the successor's file
+    assert live.retire(new, None, staged=new.write_snapshot(), expected_mutations=live.mutations)
+    live.save()
+    assert FaissStore(dim=fp_utils.EMBED_DIM, json_path=live.json_path).embedding_version == 2
+
+
+def test_sources_only_kept_for_committed_users(tmp_path, session_factory, make_app, sample_image):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    def fail(session):
+        raise RuntimeError("database went away")
+
+    user = {"name": "Ann", "age": 30, "fingerprint_image_path": sample_image, "password": "pw"}
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        event.listen(session_factory, "before_commit", fail)
+        assert client.post("/register", json=user).status_code == 400
+        assert client.post("/register/bulk", json={"users": [user]}).status_code == 400
+        assert not list((tmp_path / "sources").rglob("*.png"))
+
+        event.remove(session_factory, "before_commit", fail)
+        assert client.post("/register", json=user).status_code == 200
+        assert len(list((tmp_path / "sources").rglob("*.png"))) == 1
+
+
+def test_concurrent_writes_of_one_source(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    sources = SourceImageStore(str(tmp_path / "src"))
+    key, data = sources.encode(scans(1)[0])
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: sources.put_encoded(key, data), range(64)))
+    assert np.array_equal(sources.get(key), scans(1)[0])
+    assert [p.name for p in (tmp_path / "src").rglob("*") if p.is_file()] == [os.path.basename(sources._path(key))]
+
+
+def test_migrated_users_are_rekeyed_on_decrypt(tmp_path, monkeypatch, v2_extractor, session_factory, make_app,
+                                               sample_image):
+    import cv2
+    from fastapi.testclient import TestClient
+    from app.models import User
+
+    other_image = str(tmp_path / "other.bmp")
+    cv2.imwrite(other_image, cv2.flip(cv2.imread(sample_image, cv2.IMREAD_GRAYSCALE), 1))
+    ann = {"fingerprint_image_path": sample_image, "password": "pw"}
+
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        response = client.post("/register", json={"name": "Ann", "age": 30, **ann})
+        assert response.status_code == 200, response.text
+        user_id = response.json()["user_id"]
+        with session_factory() as db:
+            assert db.get(User, user_id).key_version == 1
+
+        monkeypatch.setattr(fp_utils, "EMBEDDING_VERSION", 2)
+        assert client.post("/admin/migrations", params={"target_version": 2}).status_code == 202
+        assert client.app.state.migration.wait(60), client.app.state.migration.error
+        assert client.get("/admin/migrations").json()["status"] == "done"
+
+        # The first decrypt derives the v1 key from the image, then re-keys to v2
+        for _ in range(2):
+            response = client.post("/decrypt", json=ann)
+            assert response.status_code == 200, response.text
+            assert (response.json()["user_id"], response.json()["name"]) == (user_id, "Ann")
+            with session_factory() as db:
+                assert db.get(User, user_id).key_version == 2
+
+        bob = {"fingerprint_image_path": other_image, "password": "pw2"}
+        response = client.post("/register", json={"name": "Bob", "age": 40, **bob})
+        assert response.status_code == 200, response.text
+        response = client.post("/decrypt", json=bob)
+        assert response.status_code == 200 and response.json()["name"] == "Bob"
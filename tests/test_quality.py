@@ -0,0 +1,44 @@
+# tests/test_quality.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import cv2
+import numpy as np
+import pytest
+
+from app.quality import QualityError, QualityGate, check_quality
+
+def test_gate_rejects_unusable_scans_with_codes(sample_image):
+    sample = cv2.imread(sample_image, cv2.IMREAD_GRAYSCALE)
+    background = int(np.median(sample))
+
+    truncated = sample.copy()
+    truncated[:, sample.shape[1] // 2:] = background
+
+    cases = {
+        "LOW_CONTRAST": np.full_like(sample, background),
+        "LOW_COVERAGE": truncated,
+        "IMAGE_TOO_SMALL": sample[:20, :20],
+    }
+
+    gate = QualityGate(enabled=True)
+    assert gate.check(sample).coverage == pytest.approx(1.0)
+    for code, image in cases.items():
+        with pytest.raises(QualityError) as exc:
+            gate.check(image)
+        assert exc.value.code == code
+        assert exc.value.detail()["code"] == code
+
+    gate.record_pipeline(0.5, count=2)
+    stats = gate.stats()
+    assert stats["checked"] == 4 and stats["passed"] == 1
+    assert stats["rejected"] == {code: 1 for code in cases}
+    assert stats["reject_rate"] == 0.75
+    assert stats["estimated_saved_ms"] == pytest.approx(750.0)
+
+
+def test_disabled_gate_passes_everything():
+    gate = QualityGate(enabled=False)
+    assert gate.check(np.zeros((100, 100), np.uint8)) is None
+    with pytest.raises(QualityError):
+        check_quality(np.zeros((100, 100), np.uint8))
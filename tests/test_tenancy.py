@@ -0,0 +1,38 @@
+# tests/test_tenancy.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+from fastapi.testclient import TestClient
+
+
+def test_tenants_have_separate_galleries(make_app, sample_image):
+    user = {"name": "Ann", "age": 30, "fingerprint_image_path": sample_image, "password": "pw"}
+    probe = {"fingerprint_image_path": sample_image, "password": "pw"}
+
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        # The same finger may enroll at two sites: duplicates are per partition
+        site_a = client.post("/register", json=user, headers={"X-Tenant": "site-a"})
+        site_b = client.post("/register", json=user, headers={"X-Tenant": "site-b"})
+        assert site_a.status_code == 200 and site_b.status_code == 200
+
+        r = client.post("/decrypt", json=probe, headers={"X-Tenant": "site-b"})
+        assert r.status_code == 200 and r.json()["user_id"] == site_b.json()["user_id"]
+        # Searches only touch the requested partition
+        miss = client.post("/decrypt", json=probe)
+        # A miss doesn't list any user ids (least of all another tenant's)
+        assert miss.status_code == 404 and miss.json()["detail"] == "No matching fingerprint found"
+        assert client.post("/decrypt", json=probe, headers={"X-Tenant": "site-c"}).json()["detail"] == "Unknown tenant: site-c"
+        assert client.post("/decrypt", json=probe, headers={"X-Tenant": "../etc"}).status_code == 422
+
+        galleries = client.get("/metrics").json()["galleries"]
+        assert galleries["site-a"]["users"] == 1 and galleries["site-a"]["queries"] == 0
+        assert galleries["site-b"]["queries"] == 1
+        assert galleries["default"]["templates"] == 0
+
+    # Partitions are persisted separately and reloaded at startup
+    with TestClient(make_app()) as client:
+        assert client.app.state.gallery.wait(5)
+        assert client.get("/readyz").json()["partitions"] == ["default", "site-a", "site-b"]
+        debug = client.get("/debug", headers={"X-Tenant": "site-a"}).json()
+        assert debug["faiss_user_ids"] == debug["database_user_ids"] == [site_a.json()["user_id"]]
@@ -0,0 +1,83 @@
+# tests/test_user_cache.py
+import os, sys
+sys.path.append(os.path.abspath("."))
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.gallery import GalleryLoader
+from app.models import Base, User
+from app.user_cache import UserRowCache
+from app.users import build_user_record
+
+
+def add_users(engine, session_factory, n_users=3):
+    Base.metadata.create_all(bind=engine)
+    db = session_factory()
+    db.add_all([build_user_record(f"user{i}", 20 + i, "pw", np.full(128, i, dtype=np.float32), 1)
+                for i in range(n_users)])
+    db.commit()
+    db.close()
+
+
+def test_read_through_invalidation_and_eviction(engine, session_factory):
+    add_users(engine, session_factory)
+    cache = UserRowCache(max_size=2)
+    cache.bind(session_factory)
+    db = session_factory()
+
+    first = cache.get(db, 1)
+    assert first.enc_name and cache.get(db, 1) is first
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert cache.get(db, 99) is None and cache.stats()["size"] == 1  # unknown ids aren't cached
+
+    # Status change and re-key through the ORM evict the row at commit
+    other = session_factory()
+    other.get(User, 1).status = "suspended"
+    other.commit()
+    assert cache.stats()["size"] == 0
+    assert cache.get(db, 1).status == "suspended"
+
+    # Bounded: least recently used row goes first
+    cache.get(db, 2)
+    cache.get(db, 1)
+    cache.get(db, 3)
+    assert cache.stats()["evictions"] == 1 and cache.get(db, 1).user_id == 1 and cache.stats()["size"] == 2
+
+    # Deletes and bulk updates are seen too
+    other.delete(other.get(User, 1))
+    other.commit()
+    assert cache.get(db, 1) is None
+    other.query(User).update({User.status: "locked"})
+    other.commit()
+    assert cache.stats()["size"] == 0 and cache.get(db, 3).status == "locked"
+    db.close()
+    other.close()
+
+
+def test_prewarmed_from_gallery_warmup(engine, session_factory):
+    add_users(engine, session_factory)
+    cache = UserRowCache(max_size=2)
+    loader = GalleryLoader(session_factory, user_cache=cache)
+    # Every user id still reaches the gallery; the cache takes what fits
+    assert loader._db_user_ids() == {"default": {1, 2, 3}}
+    assert cache.stats()["prewarmed"] == 2
+
+    db = session_factory()
+    assert cache.get(db, 1).user_id == 1 and cache.stats()["hits"] == 1
+    db.close()
+
+
+def test_decrypt_hits_cache(make_app, sample_image):
+    app = make_app()
+    with TestClient(app) as client:
+        assert client.app.state.gallery.wait(5)
+        user = {"name": "Ann", "age": 30, "fingerprint_image_path": sample_image, "password": "pw"}
+        assert client.post("/register", json=user).status_code == 200
+
+        probe = {"fingerprint_image_path": sample_image, "password": "pw"}
+        for _ in range(3):
+            r = client.post("/decrypt", json=probe)
+            assert r.status_code == 200 and r.json()["name"] == "Ann"
+        stats = client.get("/metrics").json()["user_cache"]
+        assert stats["misses"] == 1 and stats["hits"] == 2